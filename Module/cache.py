@@ -0,0 +1,451 @@
+import copy
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import closing
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+CACHE_PATH = "cache"
+
+
+class LLMResponseCache:
+    """
+        基于SQLite的LLM响应缓存。
+
+    键由提供方、模型、消息、输出格式的JSON Schema和温度计算，值为模型返回的原始文本。
+    超过ttl_seconds的条目视为过期；条目数超过max_entries时按最近访问时间淘汰（LRU）。
+    """
+
+    def __init__(self, path, ttl_seconds=86400, max_entries=10000):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+        with closing(self._connect()) as conn, conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    @staticmethod
+    def make_key(provider, model, messages, output_format=None, temperature=None):
+        payload = json.dumps({
+            "provider": provider,
+            "model": model,
+            "messages": messages,
+            "schema": output_format.model_json_schema() if output_format else None,
+            "temperature": temperature,
+        }, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def get(self, key):
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            row = conn.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl_seconds:
+                if row is not None:
+                    conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._count("misses")
+                return None
+            conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+        self._count("hits")
+        return row[0]
+
+    def put(self, key, response):
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, response, now, now)
+            )
+            conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,))
+
+            # 超出容量时淘汰最久未访问的条目
+            overflow = conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0] - self.max_entries
+            if overflow > 0:
+                conn.execute(
+                    "DELETE FROM responses WHERE key IN "
+                    "(SELECT key FROM responses ORDER BY accessed_at LIMIT ?)", (overflow,)
+                )
+                with self._lock:
+                    self._stats["evictions"] += overflow
+
+    def clear(self):
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM responses")
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+
+_caches_lock = threading.Lock()
+_llm_caches = {}
+
+
+def get_llm_cache(configuration):
+    """按缓存文件获取进程内共享的LLM响应缓存"""
+    path = os.path.join(CACHE_PATH, "llm_responses.sqlite3")
+    with _caches_lock:
+        if path not in _llm_caches:
+            _llm_caches[path] = LLMResponseCache(
+                path,
+                ttl_seconds=configuration.llm_cache_ttl_seconds,
+                max_entries=configuration.llm_cache_max_entries
+            )
+        return _llm_caches[path]
+
+
+def llm_cache_for_node(configuration, node):
+    """节点启用缓存时返回缓存对象，否则返回None"""
+    if not configuration.llm_cache_enabled:
+        return None
+    nodes = {name.strip() for name in configuration.llm_cache_nodes.split(",") if name.strip()}
+    if node not in nodes:
+        return None
+    return get_llm_cache(configuration)
+
+
+class SearchAbandonedError(RuntimeError):
+    """发出请求的调用在完成前被取消，等待同一请求的调用应重新发起"""
+
+
+class SearchCache:
+    """
+        联网搜索结果的内存缓存，并合并相同查询的并发请求。
+
+    键为规范化后的查询和搜索参数，条目在ttl_seconds后过期，超过max_entries时淘汰最早的条目。
+    同一个键同时只有一个请求真正发出，其余调用等待该请求的结果。
+    """
+
+    def __init__(self, ttl_seconds=3600, max_entries=1000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "coalesced": 0}
+
+    @staticmethod
+    def make_key(query, **params):
+        # 全角/半角、大小写和多余空白不影响缓存命中
+        normalized = " ".join(unicodedata.normalize("NFKC", query).casefold().split())
+        return normalized, tuple(sorted(params.items()))
+
+    def _get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, result = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return result
+
+    def begin(self, key):
+        """
+            返回 (缓存结果, future, 是否由调用方发出请求)。
+        命中时future为None；已有相同请求在途时返回其future；否则调用方负责发出请求，
+        并且无论成功、失败还是被取消都必须调用finish，否则等待该future的调用会一直阻塞。
+        """
+        with self._lock:
+            result = self._get(key)
+            if result is not None:
+                self._stats["hits"] += 1
+                return copy.deepcopy(result), None, False
+            if key in self._in_flight:
+                self._stats["coalesced"] += 1
+                return None, self._in_flight[key], False
+            self._stats["misses"] += 1
+            future = Future()
+            self._in_flight[key] = future
+            return None, future, True
+
+    def finish(self, key, future, result=None, error=None):
+        with self._lock:
+            self._in_flight.pop(key, None)
+            if error is None:
+                self._entries[key] = (time.monotonic() + self.ttl_seconds, result)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(error)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries))
+
+
+_search_cache = None
+
+
+def get_search_cache(configuration):
+    """获取进程内共享的搜索缓存，不同会话的相同查询共用结果"""
+    global _search_cache
+    with _caches_lock:
+        if _search_cache is None:
+            _search_cache = SearchCache(
+                ttl_seconds=configuration.search_cache_ttl_seconds,
+                max_entries=configuration.search_cache_max_entries
+            )
+        return _search_cache
+
+
+class AnswerCache:
+    """
+        基于SQLite的最终回答语义缓存。
+
+    按用户指令的向量查找相似问题的回答，只匹配相同报告模板/搜索设置(context_key)和相同语料版本的条目。
+    语料版本变化后，旧版本的回答在下次查找或写入时被删除。
+    """
+
+    def __init__(self, path, ttl_seconds=86400, max_entries=1000):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "invalidated": 0}
+        with closing(self._connect()) as conn, conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS answers (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    context_key TEXT NOT NULL,
+                    corpus_version INTEGER NOT NULL,
+                    instructions TEXT NOT NULL,
+                    embedding BLOB NOT NULL,
+                    answer TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS answers_context ON answers (context_key, corpus_version)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    @staticmethod
+    def make_context_key(report_structure, **params):
+        payload = json.dumps({"report_structure": report_structure, **params}, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _invalidate(self, conn, corpus_version):
+        deleted = conn.execute(
+            "DELETE FROM answers WHERE corpus_version != ? OR created_at < ?",
+            (corpus_version, time.time() - self.ttl_seconds)
+        ).rowcount
+        if deleted:
+            with self._lock:
+                self._stats["invalidated"] += deleted
+
+    def lookup(self, vector, context_key, corpus_version, threshold):
+        """返回相似度最高且不低于threshold的 (回答, 原指令, 相似度)，没有时返回None"""
+        vector = np.asarray(vector, dtype=np.float32)
+        vector = vector / (np.linalg.norm(vector) or 1)
+        with closing(self._connect()) as conn, conn:
+            self._invalidate(conn, corpus_version)
+            rows = conn.execute(
+                "SELECT embedding, answer, instructions FROM answers WHERE context_key = ? AND corpus_version = ?",
+                (context_key, corpus_version)
+            ).fetchall()
+
+        best = None
+        if rows:
+            embeddings = np.vstack([np.frombuffer(row[0], dtype=np.float32) for row in rows])
+            similarities = embeddings @ vector
+            i = int(np.argmax(similarities))
+            if similarities[i] >= threshold:
+                best = (rows[i][1], rows[i][2], float(similarities[i]))
+
+        with self._lock:
+            self._stats["hits" if best else "misses"] += 1
+        return best
+
+    def put(self, instructions, vector, context_key, corpus_version, answer):
+        vector = np.asarray(vector, dtype=np.float32)
+        vector = vector / (np.linalg.norm(vector) or 1)
+        with closing(self._connect()) as conn, conn:
+            self._invalidate(conn, corpus_version)
+            conn.execute(
+                "INSERT INTO answers (context_key, corpus_version, instructions, embedding, answer, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (context_key, corpus_version, instructions, vector.tobytes(), answer, time.time())
+            )
+            conn.execute(
+                "DELETE FROM answers WHERE id NOT IN (SELECT id FROM answers ORDER BY id DESC LIMIT ?)",
+                (self.max_entries,)
+            )
+
+    def clear(self):
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM answers")
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+
+_answer_caches = {}
+
+
+def get_answer_cache(configuration):
+    """获取进程内共享的最终回答缓存"""
+    path = os.path.join(CACHE_PATH, "answers.sqlite3")
+    with _caches_lock:
+        if path not in _answer_caches:
+            _answer_caches[path] = AnswerCache(
+                path,
+                ttl_seconds=configuration.answer_cache_ttl_seconds,
+                max_entries=configuration.answer_cache_max_entries
+            )
+        return _answer_caches[path]
+
+
+class CachedEmbeddings(Embeddings):
+    """
+        按内容寻址的嵌入缓存，包装任意嵌入模型。
+
+    键为 (模型标识, 文本哈希)，文本先按嵌入模型的方式规范化（换行替换为空格）。
+    先查内存LRU，再查可选的SQLite持久化存储，都未命中的文本合并为一个批次编码；
+    同一批次中重复的文本只编码一次。
+    """
+
+    def __init__(self, embeddings, model_id, max_entries=50000, path=None):
+        self.embeddings = embeddings
+        self.model_id = model_id
+        self.max_entries = max_entries
+        self.path = path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "disk_hits": 0, "misses": 0}
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with closing(self._connect()) as conn, conn:
+                conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def make_key(self, text):
+        normalized = text.replace("\n", " ")
+        return hashlib.sha256(f"{self.model_id}\0{normalized}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key, vector):
+        self._entries[key] = vector
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _load(self, keys, batch_size=500):
+        found = {}
+        with closing(self._connect()) as conn:
+            for start in range(0, len(keys), batch_size):
+                batch = keys[start:start + batch_size]
+                placeholders = ",".join("?" * len(batch))
+                for key, blob in conn.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch):
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def _store(self, vectors):
+        with closing(self._connect()) as conn, conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, vector.tobytes()) for key, vector in vectors.items()]
+            )
+
+    def embed_documents(self, texts):
+        return [vector.tolist() for vector in self._embed(texts, remember=True)]
+
+    def embed_array(self, texts, remember=True):
+        """
+            与embed_documents相同，但返回float32数组，不转换为list[list[float]]。
+
+        remember为False时不写入内存LRU（如流式入库的大量一次性文本），仍会查找缓存和写入持久化存储。
+        """
+        vectors = self._embed(texts, remember)
+        if not vectors:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.stack(vectors)
+
+    def _embed(self, texts, remember):
+        keys = [self.make_key(text) for text in texts]
+        vectors = {}
+        with self._lock:
+            for key in keys:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    vectors[key] = self._entries[key]
+
+        pending = list(dict.fromkeys(key for key in keys if key not in vectors))
+        if pending and self.path:
+            loaded = self._load(pending)
+            vectors.update(loaded)
+            pending = [key for key in pending if key not in loaded]
+        else:
+            loaded = {}
+
+        encoded = {}
+        if pending:
+            texts_by_key = dict(zip(keys, texts))
+            results = self.embeddings.embed_documents([texts_by_key[key] for key in pending])
+            encoded = {key: np.asarray(vector, dtype=np.float32) for key, vector in zip(pending, results)}
+            vectors.update(encoded)
+            if self.path:
+                self._store(encoded)
+
+        with self._lock:
+            if remember:
+                for key, vector in {**loaded, **encoded}.items():
+                    self._remember(key, vector)
+            self._stats["misses"] += len(encoded)
+            self._stats["disk_hits"] += len(loaded)
+            self._stats["hits"] += len(keys) - len(encoded) - len(loaded)
+
+        return [vectors[key] for key in keys]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self.path:
+            with closing(self._connect()) as conn, conn:
+                conn.execute("DELETE FROM embeddings")
+
+    def stats(self):
+        with self._lock:
+            total = self._stats["hits"] + self._stats["disk_hits"] + self._stats["misses"]
+            hit_rate = (self._stats["hits"] + self._stats["disk_hits"]) / total if total else 0.0
+            return dict(self._stats, entries=len(self._entries), hit_rate=hit_rate)
@@ -0,0 +1,171 @@
+import re
+import numpy as np
+from langchain_core.documents import Document
+
+# 中英文句末标点，切分时保留标点和空白，拼接后可还原原文
+SENTENCE_BOUNDARY = re.compile(r"(?<=[。！？；;\n])|(?<=[.?!]\s)")
+
+# 每次交给嵌入模型的单元数，模型返回的list[list[float]]只在一个子批次内存在
+ENCODE_BATCH_SIZE = 64
+
+
+def split_sentences(text, max_length):
+    """按句切分文本，超过max_length的长句再按长度硬切"""
+    units = []
+    for sentence in SENTENCE_BOUNDARY.split(text):
+        if not sentence.strip():
+            continue
+        for start in range(0, len(sentence), max_length):
+            units.append(sentence[start:start + max_length])
+    return units
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def _breakpoints(unit_vectors, percentile):
+    """与SemanticChunker相同的思路：相邻窗口的余弦距离超过分位数阈值处断开"""
+    if len(unit_vectors) < 3:
+        return set()
+
+    # 每个句子与前后句合并成窗口，直接对已有的句向量求和，不再重新编码
+    padded = np.vstack([unit_vectors[:1] * 0, unit_vectors, unit_vectors[:1] * 0])
+    windows = _normalize(padded[:-2] + padded[1:-1] + padded[2:])
+    distances = 1 - np.sum(windows[:-1] * windows[1:], axis=1)
+    threshold = np.percentile(distances, percentile)
+
+    # 距离下标i表示第i句与第i+1句之间
+    return {i + 1 for i, distance in enumerate(distances) if distance > threshold}
+
+
+def _document_units(doc, chunk_size):
+    """
+        文档的切分单元。
+
+    不超过chunk_size的文档（包括CSV的每一行）整体作为一个单元，不再按句或按行切开，
+    也只需编码一次；更长的文档按句切分。
+    """
+    if len(doc.page_content) <= chunk_size:
+        return [doc.page_content] if doc.page_content.strip() else []
+    return split_sentences(doc.page_content, chunk_size)
+
+
+def count_units(doc, chunk_size):
+    """文档切分后的单元数，即需要编码的向量数"""
+    return len(_document_units(doc, chunk_size))
+
+
+def encode_units(embeddings, texts, cache_vectors=True):
+    """
+        分批编码，写入预先分配的float32数组。
+
+    每个单元只占 维度×4 字节；嵌入模型返回的Python浮点数列表（每个单元约12KB）用完即释放。
+
+    Args:
+        cache_vectors (bool)：嵌入模型带缓存（CachedEmbeddings）时，是否将向量保留在内存缓存中
+    """
+    vectors = None
+    for start in range(0, len(texts), ENCODE_BATCH_SIZE):
+        batch = texts[start:start + ENCODE_BATCH_SIZE]
+        if hasattr(embeddings, "embed_array"):
+            encoded = embeddings.embed_array(batch, remember=cache_vectors)
+        else:
+            encoded = np.asarray(embeddings.embed_documents(batch), dtype=np.float32)
+        if vectors is None:
+            vectors = np.empty((len(texts), encoded.shape[1]), dtype=np.float32)
+        vectors[start:start + len(batch)] = encoded
+    return vectors
+
+
+def _pool(unit_vectors, lengths):
+    """按文本长度加权平均句向量，得到块向量"""
+    weights = np.asarray(lengths, dtype=np.float32)[:, None]
+    return _normalize(np.sum(unit_vectors * weights, axis=0))
+
+
+def _assemble(units, breakpoints, chunk_size, chunk_overlap, min_chunk_size=0):
+    """在语义断点（当前块已达到min_chunk_size时）或达到块大小时断开，返回每个块包含的句子下标"""
+    current = []
+    current_length = 0
+    for i, unit in enumerate(units):
+        semantic = i in breakpoints and current_length >= min_chunk_size
+        if current and (semantic or current_length + len(unit) > chunk_size):
+            yield current
+
+            # 语义断点处不重叠，因长度切分时保留末尾若干句作为重叠
+            overlap = []
+            if not semantic:
+                overlap_length = 0
+                for j in reversed(current):
+                    if overlap_length + len(units[j]) + len(unit) > chunk_size \
+                            or overlap_length + len(units[j]) > chunk_overlap:
+                        break
+                    overlap.insert(0, j)
+                    overlap_length += len(units[j])
+            current = overlap
+            current_length = sum(len(units[j]) for j in current)
+
+        current.append(i)
+        current_length += len(unit)
+
+    if current:
+        yield current
+
+
+def chunk_documents(
+    documents,
+    embeddings,
+    chunk_size=2000,
+    chunk_overlap=400,
+    breakpoint_percentile=95,
+    pool_embeddings=True,
+    min_chunk_size=500,
+    cache_vectors=True
+):
+    """
+        一次完成语义切分和块大小限制，并返回每个块的向量。
+
+    每个句子只经过一次编码：句向量既用于寻找语义断点，
+    在pool_embeddings为True时也直接池化为块向量，不再对块重新编码；
+    否则块向量为None，由调用方只对需要写入的块编码。
+    不超过chunk_size的文档（如CSV的一行）整体成为一个块；语义断点只在当前块达到min_chunk_size后生效，
+    避免短文本被切成零碎的小块。
+
+    Args:
+        documents: 待切分的文档列表
+        embeddings: 嵌入模型
+        chunk_size (int)：块的最大字符数
+        chunk_overlap (int)：因长度切分时相邻块的重叠字符数
+        breakpoint_percentile (float)：语义断点的分位数阈值
+        pool_embeddings (bool)：是否用句向量池化得到块向量
+        min_chunk_size (int)：在语义断点处断开所需的最小块长度
+        cache_vectors (bool)：是否将句向量保留在嵌入模型的内存缓存中
+
+    Returns:
+        list: (Document, 向量或None) 元组的列表
+    """
+    doc_units = [_document_units(doc, chunk_size) for doc in documents]
+    all_units = [unit for units in doc_units for unit in units]
+    if not all_units:
+        return []
+
+    # 所有文档的句子合并为一个批次编码
+    all_vectors = encode_units(embeddings, all_units, cache_vectors)
+
+    results = []
+    offset = 0
+    for doc, units in zip(documents, doc_units):
+        unit_vectors = all_vectors[offset:offset + len(units)]
+        offset += len(units)
+        breakpoints = _breakpoints(unit_vectors, breakpoint_percentile)
+
+        for indices in _assemble(units, breakpoints, chunk_size, chunk_overlap, min_chunk_size):
+            text = "".join(units[i] for i in indices).strip()
+            if not text:
+                continue
+            vector = _pool(unit_vectors[indices], [len(units[i]) for i in indices]) if pool_embeddings else None
+            results.append((Document(page_content=text, metadata=dict(doc.metadata)), vector))
+
+    return results
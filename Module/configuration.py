@@ -2,7 +2,9 @@ import os
 from dataclasses import dataclass, fields
 from typing import Any, Optional
 from langchain_core.runnables import RunnableConfig
-from dataclasses import dataclass
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_EMBEDDING_MODEL = os.path.join(PROJECT_ROOT, "all-MiniLM-L6-v2")
 
 DEFAULT_REPORT_STRUCTURE = """
 # 报告摘要
@@ -23,12 +25,127 @@ DEFAULT_REPORT_STRUCTURE = """
 """
 
 
+def _coerce(value, field_type):
+    """将环境变量中的字符串转换为字段声明的类型"""
+    if not isinstance(value, str) or field_type is str:
+        return value
+    if field_type is bool:
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    if field_type in (int, float):
+        return field_type(value)
+    return value
+
+
+@dataclass
 class Configuration:
     """配置字段"""
     report_structure: str = DEFAULT_REPORT_STRUCTURE
     max_search_queries: int = 5
     enable_web_search: bool = True
 
+    # 余弦相似度不低于该值的查询视为重复，只检索一次（大于1时只合并完全相同的查询）
+    query_dedup_threshold: float = 0.9
+
+    # 关闭自适应块数时，每个查询从向量库检索的文档数
+    retrieval_k: int = 3
+
+    # 检索方式：vector仅向量检索；lexical仅BM25倒排索引；hybrid两者各取hybrid_candidates个候选，按RRF融合排名
+    retrieval_mode: str = "hybrid"
+    hybrid_candidates: int = 20
+    rrf_k: int = 60
+
+    # MMR去冗余：mmr_lambda越小越偏向多样性，重叠切块产生的近似重复块会被后移
+    mmr_enabled: bool = True
+    mmr_lambda: float = 0.7
+
+    # 自适应块数：保留retrieval_min_k到retrieval_max_k个块，其余块的余弦相似度须不低于retrieval_score_cutoff，
+    # 总token数不超过retrieval_token_budget；关闭时固定取retrieval_k个
+    retrieval_adaptive_k: bool = True
+    retrieval_min_k: int = 1
+    retrieval_max_k: int = 6
+    retrieval_score_cutoff: float = 0.3
+    retrieval_token_budget: int = 2500
+
+    # 检索范围：共享语料加上当前会话上传的文档；可进一步按上传批次或来源过滤，过滤在相似度检索之前进行
+    session_id: str = ""
+    include_shared_corpus: bool = True
+    retrieval_upload_id: str = ""
+    retrieval_source: str = ""
+
+    # 会话作用域最后一次活动后保留的秒数，过期后其向量被回收
+    scope_ttl_seconds: int = 86400
+
+    # 相关性评估：llm为每个查询调用LLM；score按检索分数判断，只有分数落在高低阈值之间时才调用LLM；
+    # document逐个文档评分，保留相关文档，覆盖率不足时再联网搜索补充
+    relevance_mode: str = "score"
+    relevance_high_threshold: float = 0.6
+    relevance_low_threshold: float = 0.3
+    relevance_document_threshold: float = 0.45
+    relevance_coverage_threshold: float = 0.5
+    # 可选的交叉编码器（模型名或本地路径），配置后用其输出的概率代替余弦相似度
+    relevance_cross_encoder: str = ""
+
+    # 同时处理的查询数，受Ollama服务端并行数(OLLAMA_NUM_PARALLEL)限制
+    max_concurrent_queries: int = 3
+    ollama_num_parallel: int = 4
+
+    # 外部LLM（OpenRouter）的最大在途请求数
+    openrouter_max_concurrency: int = 8
+
+    # LLM响应缓存：按节点开启，键为模型、消息、输出格式和温度
+    llm_cache_enabled: bool = False
+    llm_cache_nodes: str = "generate_research_queries,evaluate_retrieved_documents,summarize_query_research"
+    llm_cache_ttl_seconds: int = 86400
+    llm_cache_max_entries: int = 10000
+
+    # 提示词上下文的token预算：总结节点、报告节点，以及每个网页整页内容中摘取的相关片段
+    summarizer_context_tokens: int = 3000
+    report_context_tokens: int = 6000
+    web_span_tokens: int = 600
+
+    # 流式生成最终回答，回答token（不含thinking）以LangGraph custom事件发出
+    stream_final_answer: bool = True
+
+    # 最终回答的语义缓存：相同模板和语料版本下，相似度不低于阈值的问题直接返回已有回答
+    answer_cache_enabled: bool = True
+    answer_cache_threshold: float = 0.95
+    answer_cache_ttl_seconds: int = 86400
+    answer_cache_max_entries: int = 1000
+    force_refresh: bool = False
+
+    # 联网搜索结果缓存
+    search_cache_ttl_seconds: int = 3600
+    search_cache_max_entries: int = 1000
+
+    # 嵌入模型：入库与检索共用同一套配置
+    embedding_model: str = DEFAULT_EMBEDDING_MODEL
+    embedding_device: str = "cpu"
+    embedding_batch_size: int = 32
+    embedding_normalize: bool = True
+    # 嵌入后端：torch为sentence-transformers；onnx为onnxruntime运行导出的同一模型（CPU），可选int8量化
+    embedding_backend: str = "torch"
+    embedding_onnx_quantized: bool = True
+    # 嵌入缓存：按 (模型, 文本哈希) 复用向量，可选持久化到 cache/embeddings.sqlite3
+    embedding_cache_enabled: bool = True
+    embedding_cache_max_entries: int = 50000
+    embedding_cache_persist: bool = False
+
+    # 文档切块：语义断点 + 块大小限制，一次完成
+    chunk_size: int = 2000
+    chunk_overlap: int = 400
+    chunk_breakpoint_percentile: float = 95.0
+    # 当前块不足该字符数时不在语义断点处断开；不超过chunk_size的文档和CSV行整体作为一个块
+    chunk_min_size: int = 500
+    chunk_pool_embeddings: bool = True
+
+    # 文档解析进程数（0为CPU核数）和每批切块/编码/写入的字符数
+    ingest_workers: int = 0
+    ingest_batch_chars: int = 2_000_000
+
+    # 超过该大小的CSV/文本文件改为流式分批入库，每批的内存上限
+    ingest_stream_threshold_mb: int = 64
+    ingest_memory_limit_mb: int = 256
+
     @classmethod
     def from_runnable_config(
             cls, config: Optional[RunnableConfig] = None
@@ -38,8 +155,8 @@ class Configuration:
             config["configurable"] if config and "configurable" in config else {}
         )
         values: dict[str, Any] = {
-            f.name: os.environ.get(f.name.upper(), configurable.get(f.name))
+            f.name: _coerce(os.environ.get(f.name.upper(), configurable.get(f.name)), f.type)
             for f in fields(cls)
             if f.init
         }
-        return cls(**{k: v for k, v in values.items() if v})
+        return cls(**{k: v for k, v in values.items() if v not in (None, "")})
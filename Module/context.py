@@ -0,0 +1,148 @@
+import math
+import re
+from Module.chunking import split_sentences
+
+# 中日韩字符按每字一个token估算，其余字符按每4个字符一个token估算
+CJK_CHARACTER = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]")
+WORD = re.compile(r"[0-9a-zA-Z]+")
+PASSAGE_SEPARATOR = "\n\n---\n\n"
+
+
+def estimate_tokens(text):
+    """粗略估算文本的token数，不依赖具体模型的分词器"""
+    cjk = len(CJK_CHARACTER.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def truncate_to_tokens(text, max_tokens):
+    """在不超过max_tokens的前提下按句截断，第一句就超出时按字符截断"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    if max_tokens <= 0:
+        return ""
+
+    kept = []
+    used = 0
+    for sentence in split_sentences(text, len(text)):
+        cost = estimate_tokens(sentence)
+        if used + cost > max_tokens:
+            break
+        kept.append(sentence)
+        used += cost
+    if kept:
+        return "".join(kept).strip()
+
+    cut = []
+    for ch in text:
+        used += 1 if CJK_CHARACTER.match(ch) else 0.25
+        if used > max_tokens:
+            break
+        cut.append(ch)
+    return "".join(cut).strip()
+
+
+def _terms(text):
+    """查询词：英文单词和中文相邻二字组"""
+    text = text.lower()
+    terms = set(WORD.findall(text))
+    for run in re.findall(r"[\u3400-\u4dbf\u4e00-\u9fff]+", text):
+        terms.update(run[i:i + 2] for i in range(max(1, len(run) - 1)))
+    return terms
+
+
+def extract_relevant_spans(query, text, max_tokens):
+    """
+        从整页内容中选出与查询词重合最多的句子，按原文顺序拼接，不超过max_tokens。
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+
+    query_terms = _terms(query)
+    sentences = split_sentences(text, 1000)
+    overlaps = [len(query_terms & _terms(sentence)) for sentence in sentences]
+    ranked = sorted(range(len(sentences)), key=lambda i: overlaps[i], reverse=True)
+
+    # 没有任何句子包含查询词时退化为取开头部分
+    if not ranked or overlaps[ranked[0]] == 0:
+        return truncate_to_tokens(text, max_tokens)
+    ranked = [i for i in ranked if overlaps[i] > 0]
+
+    selected = []
+    used = 0
+    for i in ranked:
+        cost = estimate_tokens(sentences[i])
+        if used + cost > max_tokens:
+            continue
+        selected.append(i)
+        used += cost
+    return " ".join(sentences[i].strip() for i in sorted(selected))
+
+
+def _shingles(text, size=5):
+    text = " ".join(text.lower().split())
+    return {text[i:i + size] for i in range(max(1, len(text) - size + 1))}
+
+
+def deduplicate_passages(passages, threshold=0.8):
+    """去掉与已保留段落重合度（字符5-gram的Jaccard相似度）不低于threshold或被其包含的段落"""
+    kept = []
+    kept_shingles = []
+    for label, text in passages:
+        shingles = _shingles(text)
+        if any(
+            len(shingles & other) / len(shingles | other) >= threshold or shingles <= other
+            for other in kept_shingles
+        ):
+            continue
+        kept.append((label, text))
+        kept_shingles.append(shingles)
+    return kept
+
+
+def document_passages(documents):
+    return [(doc.metadata.get("source", "Unknown source"), doc.page_content) for doc in documents]
+
+
+def web_passages(query, results, span_tokens):
+    """网络搜索结果转为段落：摘要加上整页内容中与查询最相关的部分，不使用结果字典的repr"""
+    passages = []
+    for result in results:
+        text = result.get("content") or ""
+        raw_content = result.get("raw_content")
+        if raw_content:
+            text = f"{text}\n{extract_relevant_spans(query, raw_content, span_tokens)}".strip()
+        passages.append((result.get("url") or result.get("title") or "Unknown source", text))
+    return passages
+
+
+def pack_context(passages, max_tokens):
+    """
+        去重后将段落装入token预算。
+
+    预算按"注水"方式分配：较短的段落完整保留，剩余预算由较长的段落平分，超出份额的段落按句截断。
+
+    Args:
+        passages: (来源, 文本) 元组的列表，来源为空时只输出文本
+        max_tokens (int)：上下文的token预算
+
+    Returns:
+        str: 按原顺序格式化后的上下文
+    """
+    passages = deduplicate_passages([(label, text) for label, text in passages if text.strip()])
+    headers = [f"Source: {label}\nContent: " if label else "" for label, _ in passages]
+    overheads = [estimate_tokens(header) + estimate_tokens(PASSAGE_SEPARATOR) for header in headers]
+    costs = [estimate_tokens(text) for _, text in passages]
+
+    allowances = [0] * len(passages)
+    remaining = max_tokens - sum(overheads)
+    order = sorted(range(len(passages)), key=lambda i: costs[i])
+    for n, i in enumerate(order):
+        allowances[i] = min(costs[i], max(0, remaining) // (len(order) - n))
+        remaining -= allowances[i]
+
+    packed = []
+    for (_, text), header, allowance in zip(passages, headers, allowances):
+        text = truncate_to_tokens(text, allowance)
+        if text:
+            packed.append(header + text)
+    return PASSAGE_SEPARATOR.join(packed)
@@ -1,40 +1,105 @@
+import asyncio
 import datetime
 from typing_extensions import Literal
-from langgraph.constants import Send
 from langgraph.graph import START, END, StateGraph
-from langchain_core.runnables.config import RunnableConfig
+from langchain_core.runnables.config import ContextThreadPoolExecutor, RunnableConfig, set_config_context
+from langgraph.types import StreamWriter
+from Module.cache import get_answer_cache, llm_cache_for_node
 from Module.configuration import Configuration
-from Module.vector_db import get_or_create_vector_db
+from Module.context import document_passages, pack_context, web_passages
+from Module.retrieval import deduplicate_queries, grade_documents, metadata_filter, relevance_gate, \
+    retrieve_documents, score_documents
+from Module.vector_db import get_embeddings, get_manifest, get_or_create_vector_db, session_scope
 from Module.state import ResearcherState, ResearcherStateInput, ResearcherStateOutput, QuerySearchState, \
     QuerySearchStateInput, QuerySearchStateOutput
 from Module.prompts import RESEARCH_QUERY_WRITER_PROMPT, RELEVANCE_EVALUATOR_PROMPT, SUMMARIZER_PROMPT, \
     REPORT_WRITER_PROMPT
 from Module.utils import format_documents_with_metadata, invoke_llm, invoke_ollama, parse_output, tavily_search, \
-    Evaluation, Queries
+    ainvoke_ollama, atavily_search, stream_ollama, astream_ollama, Evaluation, Queries, ReasoningParser
+
+def _answer_cache_key(config: RunnableConfig):
+    # 相同的问题在不同模板、搜索设置或检索范围下的回答不可互换；
+    # 会话作用域中没有文档时检索范围与不指定会话相同，不同会话可以共用回答
+    configuration = Configuration.from_runnable_config(config)
+    if configuration.session_id and not get_manifest().scope_sources(session_scope(configuration.session_id)):
+        configuration.session_id = ""
+    return get_answer_cache(configuration).make_context_key(
+        config["configurable"].get("report_structure", ""),
+        enable_web_search=config["configurable"].get("enable_web_search", False),
+        retrieval_filter=metadata_filter(configuration)
+    )
 
-# 每批并行处理的查询数
-# 根据系统的性能进行更改
-BATCH_SIZE = 3
 
+def lookup_cached_answer(state: ResearcherState, config: RunnableConfig):
+    """相同模板和语料版本下已回答过相似问题时，直接返回缓存的报告"""
+    configuration = Configuration.from_runnable_config(config)
+    # 先完成本进程对files目录的同步，否则files变化后的首个请求会读到旧的语料版本
+    get_or_create_vector_db(config)
+    corpus_version = get_manifest().corpus_version()
+    if not configuration.answer_cache_enabled or configuration.force_refresh:
+        return {"answer_cache_hit": False, "corpus_version": corpus_version}
+
+    cached = get_answer_cache(configuration).lookup(
+        get_embeddings(config).embed_query(state["user_instructions"]),
+        _answer_cache_key(config),
+        corpus_version,
+        configuration.answer_cache_threshold
+    )
+    if cached is None:
+        return {"answer_cache_hit": False, "corpus_version": corpus_version}
 
-def generate_research_queries(state: ResearcherState, config: RunnableConfig):
-    print("--- 生成queries ---")
+    answer, instructions, similarity = cached
+    print(f"--- 命中回答缓存: {instructions} ({similarity:.3f}) ---")
+    return {"final_answer": answer, "answer_cache_hit": True, "corpus_version": corpus_version}
+
+
+async def alookup_cached_answer(state: ResearcherState, config: RunnableConfig):
+    return await asyncio.to_thread(lookup_cached_answer, state, config)
+
+
+def route_cached_answer(state: ResearcherState) -> Literal["generate_research_queries", "__end__"]:
+    return "__end__" if state.get("answer_cache_hit") else "generate_research_queries"
+
+
+def store_answer(state: ResearcherState, config: RunnableConfig, answer):
+    """按运行开始时的语料版本记录回答，运行期间语料发生变化时该回答不会被命中"""
+    configuration = Configuration.from_runnable_config(config)
+    if not configuration.answer_cache_enabled or not answer:
+        return
+    get_answer_cache(configuration).put(
+        state["user_instructions"],
+        get_embeddings(config).embed_query(state["user_instructions"]),
+        _answer_cache_key(config),
+        state.get("corpus_version", get_manifest().corpus_version()),
+        answer
+    )
+
+
+def _research_queries_request(state: ResearcherState, config: RunnableConfig):
     user_instructions = state["user_instructions"]
     max_queries = config["configurable"].get("max_search_queries", 3)
 
     query_writer_prompt = RESEARCH_QUERY_WRITER_PROMPT.format(
         max_queries=max_queries,
-        date=datetime.datetime.now().strftime("%Y/%m/%d %H:%M")
+        # 日期只精确到天，同一天内相同的指令可以命中LLM缓存
+        date=datetime.datetime.now().strftime("%Y/%m/%d")
     )
 
-    # 使用本地Deepseek R1模型
-    result = invoke_ollama(
+    return dict(
         model='deepseek-r1:1.5b',
         system_prompt=query_writer_prompt,
         user_prompt=f"为用户指令生成查询: {user_instructions}",
-        output_format=Queries
+        output_format=Queries,
+        cache=llm_cache_for_node(Configuration.from_runnable_config(config), "generate_research_queries")
     )
 
+
+def generate_research_queries(state: ResearcherState, config: RunnableConfig):
+    print("--- 生成queries ---")
+
+    # 使用本地Deepseek R1模型
+    result = invoke_ollama(**_research_queries_request(state, config))
+
     # 使用外部LLM提供商与OpenRouter
     # result = invoke_llm(
     #     model='gpt-4o-mini',
@@ -46,63 +111,118 @@ def generate_research_queries(state: ResearcherState, config: RunnableConfig):
     return {"research_queries": result.queries}
 
 
-def search_queries(state: ResearcherState):
-    # 通过调用initiate_query_research来启动对每个查询的搜索
-    print("--- 检索queries ---")
-    pass
+async def agenerate_research_queries(state: ResearcherState, config: RunnableConfig):
+    print("--- 生成queries ---")
+    result = await ainvoke_ollama(**_research_queries_request(state, config))
+
+    return {"research_queries": result.queries}
+
+
+def deduplicate_research_queries(state: ResearcherState, config: RunnableConfig):
+    """合并语义重复的查询，避免对近似改写的查询重复检索、评估和总结"""
+    queries, saved_branches = deduplicate_queries(state["research_queries"], config)
+    print(f"--- 查询去重: {len(state['research_queries'])} -> {len(queries)} ---")
 
+    return {"research_queries": queries, "saved_branches": saved_branches}
 
-def initiate_query_research(state: ResearcherState):
-    # 使用Send方法并调用“search_and_summarize_query”子图并行地开始对每个查询的搜索
-    return [
-        Send("search_and_summarize_query", {"query": s})
-        for s in state["research_queries"]
-    ]
 
+async def adeduplicate_research_queries(state: ResearcherState, config: RunnableConfig):
+    # 查询编码是CPU计算，放到线程中执行
+    return await asyncio.to_thread(deduplicate_research_queries, state, config)
 
-def search_queries(state: ResearcherState):
-    # 通过调用initiate_query_research来启动对每个查询的搜索
-    print("--- 检索queries ---")
-    # Get the current processing position from state or initialize to 0
-    current_position = state.get("current_position", 0)
 
-    return {"current_position": current_position + BATCH_SIZE}
+def prefetch_rag_documents(state: ResearcherState, config: RunnableConfig):
+    """一次编码全部查询并批量查询向量库，结果分发给各查询子图"""
+    print("--- 批量检索 documents ---")
 
+    return {"prefetched_documents": retrieve_documents(state["research_queries"], config)}
 
-def check_more_queries(state: ResearcherState) -> Literal["search_queries", "generate_final_answer"]:
-    """核查queries数量"""
-    current_position = state.get("current_position", 0)
-    if current_position < len(state["research_queries"]):
-        return "search_queries"
-    return "generate_final_answer"
 
+async def aprefetch_rag_documents(state: ResearcherState, config: RunnableConfig):
+    return await asyncio.to_thread(prefetch_rag_documents, state, config)
 
-def initiate_query_research(state: ResearcherState):
-    # 获取下一批查询
-    queries = state["research_queries"]
-    current_position = state["current_position"]
-    batch_end = min(current_position, len(queries))
-    current_batch = queries[current_position - BATCH_SIZE:batch_end]
 
-    # 返回要处理的查询批次
-    return [
-        Send("search_and_summarize_query", {"query": s})
-        for s in current_batch
-    ]
+def _query_input(state: ResearcherState, query):
+    prefetched = (state.get("prefetched_documents") or {}).get(query)
+    if prefetched is None:
+        return {"query": query}
+    return {"query": query, "retrieved_documents": prefetched}
 
 
-def retrieve_rag_documents(state: QuerySearchState):
-    """从RAG数据库检索文档"""
+def query_concurrency(config: RunnableConfig):
+    """同时处理的查询数，不超过Ollama服务端的并行数"""
+    configuration = Configuration.from_runnable_config(config)
+    return max(1, min(configuration.max_concurrent_queries, configuration.ollama_num_parallel))
+
+
+def _collect_summaries(results):
+    # 被跳过的查询（无相关文档且联网被禁用）没有摘要
+    return {"search_summaries": [summary for result in results for summary in result.get("search_summaries", [])]}
+
+
+def make_query_scheduler(query_search_subgraph):
+    """
+        滑动窗口调度：最多同时运行N个查询子图，任一查询完成后立即开始下一个，
+        不必等待同一批次中最慢的查询。
+    """
+
+    def search_and_summarize_query(state: ResearcherState, config: RunnableConfig):
+        print("--- 检索queries ---")
+        queries = state["research_queries"]
+        with ContextThreadPoolExecutor(max_workers=query_concurrency(config)) as pool:
+            results = list(pool.map(
+                lambda query: query_search_subgraph.invoke(_query_input(state, query), config), queries
+            ))
+
+        return _collect_summaries(results)
+
+    return search_and_summarize_query
+
+
+def make_async_query_scheduler(query_search_subgraph):
+    """make_query_scheduler的异步版本，用信号量限制同时运行的查询子图数"""
+
+    async def search_and_summarize_query(state: ResearcherState, config: RunnableConfig):
+        print("--- 检索queries ---")
+        semaphore = asyncio.Semaphore(query_concurrency(config))
+
+        async def run(query):
+            async with semaphore:
+                return await query_search_subgraph.ainvoke(_query_input(state, query), config)
+
+        results = await asyncio.gather(*(run(query) for query in state["research_queries"]))
+
+        return _collect_summaries(results)
+
+    return search_and_summarize_query
+
+
+def retrieve_rag_documents(state: QuerySearchState, config: RunnableConfig):
+    """从RAG数据库检索文档，已批量预取时直接使用预取结果"""
+    if state.get("retrieved_documents") is not None:
+        return {}
+
+    print("--- 检索 documents ---")
+    query = state["query"]
+    documents = retrieve_documents([query], config)[query]
+
+    return {"retrieved_documents": documents}
+
+
+async def aretrieve_rag_documents(state: QuerySearchState, config: RunnableConfig):
+    """retrieve_rag_documents的异步版本"""
+    if state.get("retrieved_documents") is not None:
+        return {}
+
     print("--- 检索 documents ---")
     query = state["query"]
-    vectorstore = get_or_create_vector_db()
-    vectorstore_retreiver = vectorstore.as_retriever(search_type="similarity", search_kwargs={"k": 3})
-    documents = vectorstore_retreiver.invoke(query)
+    # 首次调用可能需要同步files目录，编码和查询也是阻塞调用，放到线程中执行
+    documents = (await asyncio.to_thread(retrieve_documents, [query], config))[query]
 
     return {"retrieved_documents": documents}
 
 
-def evaluate_retrieved_documents(state: QuerySearchState):
+def _evaluation_request(state: QuerySearchState, config: RunnableConfig):
     query = state["query"]
     retrieved_documents = state["retrieved_documents"]
     evaluation_prompt = RELEVANCE_EVALUATOR_PROMPT.format(
@@ -110,14 +230,49 @@ def evaluate_retrieved_documents(state: QuerySearchState):
         documents=format_documents_with_metadata(retrieved_documents)
     )
 
-    # Using local Deepseek R1 model with Ollama
-    evaluation = invoke_ollama(
+    return dict(
         model='deepseek-r1:1.5b',
         system_prompt=evaluation_prompt,
         user_prompt=f"检索文档，评估与文档用户请求的相关性: {query}",
-        output_format=Evaluation
+        output_format=Evaluation,
+        cache=llm_cache_for_node(Configuration.from_runnable_config(config), "evaluate_retrieved_documents")
     )
 
+
+def gate_retrieved_documents(state: QuerySearchState, config: RunnableConfig):
+    """score模式下根据检索分数直接判断相关性，无法判断时返回None"""
+    if Configuration.from_runnable_config(config).relevance_mode != "score":
+        return None
+    verdict = relevance_gate(score_documents(state["query"], state["retrieved_documents"], config), config)
+    if verdict is not None:
+        print(f"--- 按分数判断相关性: {verdict} ---")
+    return verdict
+
+
+def grade_retrieved_documents(state: QuerySearchState, config: RunnableConfig):
+    """document模式下逐个文档评分，只保留相关文档，覆盖率不足时标记需要联网补充"""
+    configuration = Configuration.from_runnable_config(config)
+    kept, coverage = grade_documents(state["query"], state["retrieved_documents"], config)
+    print(f"--- 逐个文档评分: 保留 {len(kept)}/{len(state['retrieved_documents'])} ---")
+
+    return {
+        "retrieved_documents": kept,
+        "are_documents_relevant": bool(kept),
+        "needs_web_search": coverage < configuration.relevance_coverage_threshold
+    }
+
+
+def evaluate_retrieved_documents(state: QuerySearchState, config: RunnableConfig):
+    if Configuration.from_runnable_config(config).relevance_mode == "document":
+        return grade_retrieved_documents(state, config)
+
+    verdict = gate_retrieved_documents(state, config)
+    if verdict is not None:
+        return {"are_documents_relevant": verdict}
+
+    # Using local Deepseek R1 model with Ollama
+    evaluation = invoke_ollama(**_evaluation_request(state, config))
+
     # 使用外部LLM提供商与OpenRouter
     # evaluation = invoke_llm(
     #     model='gpt-4o-mini',
@@ -129,13 +284,31 @@ def evaluate_retrieved_documents(state: QuerySearchState):
     return {"are_documents_relevant": evaluation.is_relevant}
 
 
+async def aevaluate_retrieved_documents(state: QuerySearchState, config: RunnableConfig):
+    # 交叉编码器推理是CPU计算，放到线程中执行
+    if Configuration.from_runnable_config(config).relevance_mode == "document":
+        return await asyncio.to_thread(grade_retrieved_documents, state, config)
+
+    verdict = await asyncio.to_thread(gate_retrieved_documents, state, config)
+    if verdict is not None:
+        return {"are_documents_relevant": verdict}
+
+    evaluation = await ainvoke_ollama(**_evaluation_request(state, config))
+
+    return {"are_documents_relevant": evaluation.is_relevant}
+
+
 def route_research(state: QuerySearchState, config: RunnableConfig) -> Literal[
     "summarize_query_research", "web_research", "__end__"]:
     """ 根据文件的相关性进行研究 """
 
-    if state["are_documents_relevant"]:
+    web_enabled = config["configurable"].get("enable_web_search", False)
+    if state.get("needs_web_search") and web_enabled:
+        # 保留的本地文档不足，联网搜索补充后一起总结
+        return "web_research"
+    elif state["are_documents_relevant"]:
         return "summarize_query_research"
-    elif config["configurable"].get("enable_web_search", False):
+    elif web_enabled:
         return "web_research"
     else:
         print("无相关文档且网络被禁用，该请求跳过")
@@ -150,28 +323,42 @@ def web_research(state: QuerySearchState):
     return {"web_search_results": search_results}
 
 
-def summarize_query_research(state: QuerySearchState):
+async def aweb_research(state: QuerySearchState):
+    print("--- 联网搜索 ---")
+    output = await atavily_search(state["query"])
+    search_results = output["results"]
+
+    return {"web_search_results": search_results}
+
+
+def _summary_request(state: QuerySearchState, config: RunnableConfig):
     query = state["query"]
+    configuration = Configuration.from_runnable_config(config)
 
-    information = None
+    passages = []
     if state["are_documents_relevant"]:
         # 如果文档是相关的：使用RAG文档
-        information = state["retrieved_documents"]
-    else:
-        # 如果文档是不相关的：使用网络搜索结果，
-        # 如果启用，否则将跳过上一个路由器节点的查询
-        information = state["web_search_results"]
+        passages += document_passages(state["retrieved_documents"])
+    if state.get("web_search_results"):
+        # 文档不相关或保留的相关文档覆盖不足：使用网络搜索结果，
+        # 只取整页内容中与查询相关的片段
+        passages += web_passages(query, state["web_search_results"], configuration.web_span_tokens)
 
     summary_prompt = SUMMARIZER_PROMPT.format(
         query=query,
-        docmuents=information
+        docmuents=pack_context(passages, configuration.summarizer_context_tokens)
     )
 
-    summary = invoke_ollama(
+    return dict(
         model='deepseek-r1:1.5b',
         system_prompt=summary_prompt,
-        user_prompt=f"为这个请求生成一个摘要: {query}"
+        user_prompt=f"为这个请求生成一个摘要: {query}",
+        cache=llm_cache_for_node(configuration, "summarize_query_research")
     )
+
+
+def summarize_query_research(state: QuerySearchState, config: RunnableConfig):
+    summary = invoke_ollama(**_summary_request(state, config))
     # 移除thinking
     summary = parse_output(summary)["response"]
 
@@ -185,23 +372,51 @@ def summarize_query_research(state: QuerySearchState):
     return {"search_summaries": [summary]}
 
 
-def generate_final_answer(state: ResearcherState, config: RunnableConfig):
-    print("--- 生成回答 ---")
+async def asummarize_query_research(state: QuerySearchState, config: RunnableConfig):
+    summary = await ainvoke_ollama(**_summary_request(state, config))
+    # 移除thinking
+    summary = parse_output(summary)["response"]
+
+    return {"search_summaries": [summary]}
+
+
+def _final_answer_request(state: ResearcherState, config: RunnableConfig):
     report_structure = config["configurable"].get("report_structure", "")
+    configuration = Configuration.from_runnable_config(config)
     answer_prompt = REPORT_WRITER_PROMPT.format(
         instruction=state["user_instructions"],
         report_structure=report_structure,
-        information="\n\n---\n\n".join(state["search_summaries"])
+        # 各查询的摘要去重后平分token预算
+        information=pack_context([("", summary) for summary in state["search_summaries"]],
+                                 configuration.report_context_tokens)
     )
 
-    # Using local Deepseek R1 model with Ollama
-    result = invoke_ollama(
+    return dict(
         model='deepseek-r1:1.5b',
         system_prompt=answer_prompt,
-        user_prompt=f"使用提供的信息生成研究摘要。"
+        user_prompt=f"使用提供的信息生成研究摘要。",
+        cache=llm_cache_for_node(configuration, "generate_final_answer")
     )
-    # 移除thinking
-    answer = parse_output(result)["response"]
+
+
+def generate_final_answer(state: ResearcherState, config: RunnableConfig, writer: StreamWriter):
+    print("--- 生成回答 ---")
+
+    # Using local Deepseek R1 model with Ollama
+    if Configuration.from_runnable_config(config).stream_final_answer:
+        # 边生成边以custom事件发出回答token（不含thinking），stream_mode包含"custom"时可见
+        parser = ReasoningParser()
+        for chunk in stream_ollama(**_final_answer_request(state, config)):
+            if token := parser.feed(chunk):
+                writer({"final_answer_token": token})
+        if token := parser.close():
+            writer({"final_answer_token": token})
+        # 移除thinking
+        answer = parser.response
+    else:
+        result = invoke_ollama(**_final_answer_request(state, config))
+        # 移除thinking
+        answer = parse_output(result)["response"]
 
     # 使用外部LLM提供商与OpenRouter
     # answer = invoke_llm(
@@ -210,41 +425,90 @@ def generate_final_answer(state: ResearcherState, config: RunnableConfig):
     #     user_prompt=f"Generate a research summary using the provided information."
     # )
 
-    return {"final_answer": answer}
+    store_answer(state, config, answer)
 
+    return {"final_answer": answer}
 
-# 创建用于搜索每个查询的子图
-query_search_subgraph = StateGraph(QuerySearchState, input=QuerySearchStateInput, output=QuerySearchStateOutput)
 
-# 定义用于搜索查询的子图节点
-query_search_subgraph.add_node(retrieve_rag_documents)
-query_search_subgraph.add_node(evaluate_retrieved_documents)
-query_search_subgraph.add_node(web_research)
-query_search_subgraph.add_node(summarize_query_research)
+async def agenerate_final_answer(state: ResearcherState, config: RunnableConfig, writer: StreamWriter):
+    print("--- 生成回答 ---")
+    if Configuration.from_runnable_config(config).stream_final_answer:
+        parser = ReasoningParser()
+        # Python 3.10的异步节点中没有runnable上下文，writer需要在带有config的上下文中调用
+        with set_config_context(config) as context:
+            async for chunk in astream_ollama(**_final_answer_request(state, config)):
+                if token := parser.feed(chunk):
+                    context.run(writer, {"final_answer_token": token})
+            if token := parser.close():
+                context.run(writer, {"final_answer_token": token})
+        answer = parser.response
+    else:
+        result = await ainvoke_ollama(**_final_answer_request(state, config))
+        # 移除thinking
+        answer = parse_output(result)["response"]
+    await asyncio.to_thread(store_answer, state, config, answer)
 
-# 为子图设置入口点并定义转换
-query_search_subgraph.add_edge(START, "retrieve_rag_documents")
-query_search_subgraph.add_edge("retrieve_rag_documents", "evaluate_retrieved_documents")
-query_search_subgraph.add_conditional_edges("evaluate_retrieved_documents", route_research)
-query_search_subgraph.add_edge("web_research", "summarize_query_research")
-query_search_subgraph.add_edge("summarize_query_research", END)
+    return {"final_answer": answer}
 
-# 创建主图
-researcher_graph = StateGraph(ResearcherState, input=ResearcherStateInput, output=ResearcherStateOutput,
-                              config_schema=Configuration)
 
-# 定义主节点
-researcher_graph.add_node(generate_research_queries)
-researcher_graph.add_node(search_queries)
-researcher_graph.add_node("search_and_summarize_query", query_search_subgraph.compile())
-researcher_graph.add_node(generate_final_answer)
+def build_researcher(use_async=False):
+    """
+        构建研究图。use_async为True时各节点使用异步的LLM、搜索和检索调用，
+        编译后的图通过 ainvoke/astream 在事件循环上运行，多个会话可共用一个进程。
+    """
+    if use_async:
+        nodes = (aretrieve_rag_documents, aevaluate_retrieved_documents, aweb_research, asummarize_query_research,
+                 alookup_cached_answer, agenerate_research_queries, adeduplicate_research_queries,
+                 aprefetch_rag_documents, agenerate_final_answer)
+    else:
+        nodes = (retrieve_rag_documents, evaluate_retrieved_documents, web_research, summarize_query_research,
+                 lookup_cached_answer, generate_research_queries, deduplicate_research_queries,
+                 prefetch_rag_documents, generate_final_answer)
+    retrieve, evaluate, web, summarize, lookup_answer, generate_queries, deduplicate, prefetch, final_answer = nodes
+
+    # 创建用于搜索每个查询的子图
+    query_search_subgraph = StateGraph(QuerySearchState, input=QuerySearchStateInput, output=QuerySearchStateOutput)
+
+    # 定义用于搜索查询的子图节点
+    query_search_subgraph.add_node("retrieve_rag_documents", retrieve)
+    query_search_subgraph.add_node("evaluate_retrieved_documents", evaluate)
+    query_search_subgraph.add_node("web_research", web)
+    query_search_subgraph.add_node("summarize_query_research", summarize)
+
+    # 为子图设置入口点并定义转换
+    query_search_subgraph.add_edge(START, "retrieve_rag_documents")
+    query_search_subgraph.add_edge("retrieve_rag_documents", "evaluate_retrieved_documents")
+    query_search_subgraph.add_conditional_edges("evaluate_retrieved_documents", route_research)
+    query_search_subgraph.add_edge("web_research", "summarize_query_research")
+    query_search_subgraph.add_edge("summarize_query_research", END)
+
+    # 创建主图
+    researcher_graph = StateGraph(ResearcherState, input=ResearcherStateInput, output=ResearcherStateOutput,
+                                  config_schema=Configuration)
+
+    # 定义主节点
+    make_scheduler = make_async_query_scheduler if use_async else make_query_scheduler
+    researcher_graph.add_node("lookup_cached_answer", lookup_answer)
+    researcher_graph.add_node("generate_research_queries", generate_queries)
+    researcher_graph.add_node("deduplicate_research_queries", deduplicate)
+    researcher_graph.add_node("prefetch_rag_documents", prefetch)
+    researcher_graph.add_node("search_and_summarize_query", make_scheduler(query_search_subgraph.compile()))
+    researcher_graph.add_node("generate_final_answer", final_answer)
+
+    # 定义主图的关系
+    researcher_graph.add_edge(START, "lookup_cached_answer")
+    researcher_graph.add_conditional_edges("lookup_cached_answer", route_cached_answer)
+    researcher_graph.add_edge("generate_research_queries", "deduplicate_research_queries")
+    researcher_graph.add_edge("deduplicate_research_queries", "prefetch_rag_documents")
+    researcher_graph.add_edge("prefetch_rag_documents", "search_and_summarize_query")
+    researcher_graph.add_edge("search_and_summarize_query", "generate_final_answer")
+    researcher_graph.add_edge("generate_final_answer", END)
+
+    return researcher_graph.compile()
 
-# 定义主图的关系
-researcher_graph.add_edge(START, "generate_research_queries")
-researcher_graph.add_edge("generate_research_queries", "search_queries")
-researcher_graph.add_conditional_edges("search_queries", initiate_query_research, ["search_and_summarize_query"])
-researcher_graph.add_conditional_edges("search_and_summarize_query", check_more_queries)
-researcher_graph.add_edge("generate_final_answer", END)
 
 # 创建主图对象
-researcher = researcher_graph.compile()
+researcher = build_researcher()
+
+# 异步主图对象，支持 ainvoke/astream
+async_researcher = build_researcher(use_async=True)
@@ -0,0 +1,157 @@
+import math
+import os
+import re
+import sqlite3
+from collections import Counter
+from contextlib import closing
+
+LEXICAL_INDEX_FILE = "lexical_index.sqlite3"
+
+# 英文单词/数字，以及中日韩字符串
+TOKEN = re.compile(r"[0-9a-z]+|[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]+")
+
+
+def tokenize(text):
+    """
+        中英文混合分词：英文和数字按单词（小写），中日韩文本按单字和相邻二字组。
+
+    二字组可以匹配大多数中文词语，单字保证单字查询和未登录词也能命中，不依赖分词词典。
+    """
+    tokens = []
+    for match in TOKEN.findall(text.lower()):
+        if match[0].isascii():
+            tokens.append(match)
+            continue
+        tokens.extend(match)
+        tokens.extend(match[i:i + 2] for i in range(len(match) - 1))
+    return tokens
+
+
+class LexicalIndex:
+    """
+        基于SQLite的BM25倒排索引，与向量库使用相同的块ID。
+
+    postings表记录每个词在每个块中的词频，chunks表记录块长度和用于检索过滤的scope/upload_id/source元数据，
+    入库和删除块时与向量库同步更新。
+    """
+
+    def __init__(self, directory, k1=1.5, b=0.75):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, LEXICAL_INDEX_FILE)
+        self.k1 = k1
+        self.b = b
+        with closing(self._connect()) as conn, conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS chunks (
+                    chunk_id TEXT PRIMARY KEY,
+                    length INTEGER NOT NULL,
+                    scope TEXT,
+                    upload_id TEXT,
+                    source TEXT
+                );
+                CREATE TABLE IF NOT EXISTS postings (
+                    term TEXT NOT NULL,
+                    chunk_id TEXT NOT NULL,
+                    tf INTEGER NOT NULL,
+                    PRIMARY KEY (term, chunk_id)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS postings_chunk ON postings (chunk_id);
+            """)
+            # 旧版索引的chunks表没有过滤用的元数据列，清空后由调用方从向量库回填
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(chunks)")}
+            if "scope" not in columns:
+                for column in ("scope", "upload_id", "source"):
+                    conn.execute(f"ALTER TABLE chunks ADD COLUMN {column} TEXT")
+                conn.execute("DELETE FROM postings")
+                conn.execute("DELETE FROM chunks")
+            conn.execute("CREATE INDEX IF NOT EXISTS chunks_scope ON chunks (scope)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def count(self):
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def add(self, chunk_ids, texts, metadatas=None):
+        """写入或替换块的词频，metadatas为与向量库相同的块元数据"""
+        metadatas = metadatas or [None] * len(chunk_ids)
+        with closing(self._connect()) as conn, conn:
+            for chunk_id, text, metadata in zip(chunk_ids, texts, metadatas):
+                counts = Counter(tokenize(text))
+                metadata = metadata or {}
+                conn.execute("DELETE FROM postings WHERE chunk_id = ?", (chunk_id,))
+                conn.execute(
+                    "INSERT OR REPLACE INTO chunks (chunk_id, length, scope, upload_id, source) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (chunk_id, sum(counts.values()), metadata.get("scope"), metadata.get("upload_id"),
+                     metadata.get("source"))
+                )
+                conn.executemany(
+                    "INSERT INTO postings (term, chunk_id, tf) VALUES (?, ?, ?)",
+                    [(term, chunk_id, tf) for term, tf in counts.items()]
+                )
+
+    def remove(self, chunk_ids):
+        with closing(self._connect()) as conn, conn:
+            conn.executemany("DELETE FROM postings WHERE chunk_id = ?", [(i,) for i in chunk_ids])
+            conn.executemany("DELETE FROM chunks WHERE chunk_id = ?", [(i,) for i in chunk_ids])
+
+    def set_upload_id(self, chunk_ids, upload_id):
+        with closing(self._connect()) as conn, conn:
+            conn.executemany("UPDATE chunks SET upload_id = ? WHERE chunk_id = ?", [(upload_id, i) for i in chunk_ids])
+
+    def search(self, query, k=10, scopes=None, upload_id=None, source=None):
+        """
+            按BM25返回得分最高的k个块，k为None时返回全部命中的块。
+
+        过滤条件在计分之前应用于chunks表，词频统计和平均长度也只在过滤后的块中计算。
+
+        Args:
+            scopes: 可选的作用域列表，只检索其中的块
+            upload_id (str)、source (str)：可选，只检索该上传批次或来源的块
+
+        Returns:
+            list: (块ID, 分数) 元组的列表，按分数从高到低排列
+        """
+        terms = Counter(tokenize(query))
+        if not terms:
+            return []
+
+        conditions = []
+        params = []
+        if scopes is not None:
+            conditions.append(f"c.scope IN ({','.join('?' * len(scopes))})")
+            params.extend(scopes)
+        for column, value in (("upload_id", upload_id), ("source", source)):
+            if value:
+                conditions.append(f"c.{column} = ?")
+                params.append(value)
+        where = "".join(f" AND {condition}" for condition in conditions)
+
+        with closing(self._connect()) as conn:
+            total, total_length = conn.execute(
+                f"SELECT COUNT(*), SUM(length) FROM chunks c WHERE 1 = 1{where}", params
+            ).fetchone()
+            if not total:
+                return []
+            placeholders = ",".join("?" * len(terms))
+            rows = conn.execute(
+                f"SELECT p.term, p.chunk_id, p.tf, c.length FROM postings p "
+                f"JOIN chunks c ON c.chunk_id = p.chunk_id WHERE p.term IN ({placeholders}){where}",
+                list(terms) + params
+            ).fetchall()
+
+        document_frequency = Counter(term for term, _, _, _ in rows)
+        average_length = total_length / total
+        scores = Counter()
+        for term, chunk_id, tf, length in rows:
+            idf = math.log(1 + (total - document_frequency[term] + 0.5) / (document_frequency[term] + 0.5))
+            norm = tf + self.k1 * (1 - self.b + self.b * length / average_length)
+            scores[chunk_id] += terms[term] * idf * tf * (self.k1 + 1) / norm
+        return scores.most_common(k)
+
+    def clear(self):
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM postings")
+            conn.execute("DELETE FROM chunks")
@@ -0,0 +1,245 @@
+import codecs
+import csv
+import io
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pdfplumber
+from langchain_core.documents import Document
+from langchain_community.document_loaders import CSVLoader, TextLoader, PDFPlumberLoader
+
+# 按扩展名选择合适的加载程序
+LOADERS = {
+    "csv": CSVLoader,
+    "txt": TextLoader,
+    "md": TextLoader,
+    "pdf": PDFPlumberLoader,
+}
+
+# CPU密集型、需要放到进程池中解析的类型
+POOLED_EXTENSIONS = {"pdf"}
+
+# 可以逐行流式读取的类型
+STREAMABLE_EXTENSIONS = {"csv", "txt", "md"}
+
+
+def file_extension(path):
+    return os.path.splitext(path)[1].lstrip(".").lower()
+
+
+def is_supported(path):
+    return file_extension(path) in LOADERS
+
+
+def load_file(path):
+    """使用扩展名对应的加载程序加载文件，不支持的类型返回空列表"""
+    loader_cls = LOADERS.get(file_extension(path))
+    if loader_cls is None:
+        return []
+    if loader_cls is TextLoader:
+        return loader_cls(path, autodetect_encoding=True).load()
+    return loader_cls(path).load()
+
+
+def _decode(buffer):
+    try:
+        return str(buffer, "utf-8-sig")
+    except UnicodeDecodeError:
+        return str(buffer, "gb18030")
+
+
+def _load_text_buffer(name, buffer):
+    return [Document(page_content=_decode(buffer), metadata={"source": name})]
+
+
+def _csv_row_document(name, i, row):
+    """与CSVLoader相同的格式：每行一个文档，内容为 "列名: 值" """
+    return Document(
+        page_content="\n".join(
+            f"{k.strip() if k is not None else k}: {v.strip() if isinstance(v, str) else v}"
+            for k, v in row.items()
+        ),
+        metadata={"source": name, "row": i}
+    )
+
+
+def _load_csv_buffer(name, buffer):
+    reader = csv.DictReader(io.StringIO(_decode(buffer), newline=""))
+    return [_csv_row_document(name, i, row) for i, row in enumerate(reader)]
+
+
+def _load_pdf_buffer(name, buffer):
+    """与PDFPlumberLoader相同的格式：每页一个文档"""
+    with pdfplumber.open(io.BytesIO(buffer)) as pdf:
+        total_pages = len(pdf.pages)
+        return [
+            Document(
+                page_content=page.extract_text() or "",
+                metadata={"source": name, "file_path": name, "page": i, "total_pages": total_pages}
+            )
+            for i, page in enumerate(pdf.pages)
+        ]
+
+
+# 可直接从内存缓冲区读取的类型
+BUFFER_LOADERS = {
+    "csv": _load_csv_buffer,
+    "txt": _load_text_buffer,
+    "md": _load_text_buffer,
+    "pdf": _load_pdf_buffer,
+}
+
+
+def load_buffer(name, buffer):
+    """
+        直接从内存缓冲区（bytes/memoryview）加载文档，不写临时文件。
+
+    只有路径加载程序可用的类型才写入本次调用私有的临时目录，避免并发上传互相覆盖。
+    """
+    extension = file_extension(name)
+    if extension in BUFFER_LOADERS:
+        return BUFFER_LOADERS[extension](name, buffer)
+    if extension not in LOADERS:
+        return []
+
+    with tempfile.TemporaryDirectory(prefix="upload_") as temp_folder:
+        temp_file_path = os.path.join(temp_folder, os.path.basename(name))
+        with open(temp_file_path, "wb") as f:
+            f.write(buffer)
+        docs = load_file(temp_file_path)
+    for doc in docs:
+        doc.metadata["source"] = name
+    return docs
+
+
+class _BufferReader(io.RawIOBase):
+    """在内存缓冲区上按需读取，不复制整个缓冲区"""
+
+    def __init__(self, buffer):
+        self._buffer = memoryview(buffer).cast("B")
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        size = min(len(b), len(self._buffer) - self._position)
+        b[:size] = self._buffer[self._position:self._position + size]
+        self._position += size
+        return size
+
+
+def _open_binary(source):
+    if isinstance(source, tuple):
+        return io.BufferedReader(_BufferReader(source[1]))
+    return open(source, "rb")
+
+
+def _detect_encoding(head):
+    """根据文件开头判断编码，流式读取时无法在出错后再整体重试"""
+    try:
+        codecs.getincrementaldecoder("utf-8-sig")().decode(head, final=False)
+        return "utf-8-sig"
+    except UnicodeDecodeError:
+        return "gb18030"
+
+
+def source_size(source):
+    if isinstance(source, tuple):
+        return memoryview(source[1]).nbytes
+    return os.path.getsize(source)
+
+
+def iter_stream_documents(source, start=0, block_chars=8000):
+    """
+        逐行流式读取CSV/文本文件，不将整个文件加载为文档列表。
+
+    CSV每行生成一个文档（与CSVLoader格式相同），文本按行累积到block_chars生成一个文档。
+
+    Args:
+        source: 文件路径或 (文件名, 缓冲区) 元组
+        start (int)：从第几行（CSV为数据行）开始，用于断点续传
+        block_chars (int)：文本文件每个文档的最大字符数
+
+    Yields:
+        tuple: (文档, 读完该文档后的行号)
+    """
+    name = source_name(source)
+    with _open_binary(source) as binary:
+        encoding = _detect_encoding(binary.peek(1 << 16)[:1 << 16])
+        stream = io.TextIOWrapper(binary, encoding=encoding, errors="replace", newline="")
+
+        if file_extension(name) == "csv":
+            for i, row in enumerate(csv.DictReader(stream)):
+                if i >= start:
+                    yield _csv_row_document(name, i, row), i + 1
+            return
+
+        lines = []
+        length = 0
+        line_number = 0
+        for line_number, line in enumerate(stream, start=1):
+            if line_number <= start:
+                continue
+            lines.append(line)
+            length += len(line)
+            if length >= block_chars:
+                yield Document(page_content="".join(lines), metadata={"source": name}), line_number
+                lines = []
+                length = 0
+        if lines:
+            yield Document(page_content="".join(lines), metadata={"source": name}), line_number
+
+
+def _timed_load(source):
+    """source为文件路径或 (文件名, 缓冲区) 元组"""
+    start = time.perf_counter()
+    docs = load_buffer(*source) if isinstance(source, tuple) else load_file(source)
+    return docs, time.perf_counter() - start
+
+
+def source_name(source):
+    return source[0] if isinstance(source, tuple) else source
+
+
+def iter_loaded_files(sources, max_workers=None):
+    """
+        并行解析文件（pdfplumber解析是CPU密集型的），按完成顺序逐个返回结果。
+
+    文本和CSV在当前进程中直接解析，PDF放到进程池中解析。
+
+    Args:
+        sources: 文件路径或 (文件名, 缓冲区) 元组的列表
+        max_workers (int)：进程数，None为CPU核数，1为在当前进程中顺序解析
+
+    Yields:
+        tuple: (路径或文件名, 文档列表, 解析耗时秒数, 异常或None)
+    """
+    pooled = [s for s in sources if file_extension(source_name(s)) in POOLED_EXTENSIONS]
+    if len(pooled) <= 1 or max_workers == 1:
+        pooled = []
+    inline = [s for s in sources if not any(s is p for p in pooled)]
+
+    for source in inline:
+        try:
+            docs, seconds = _timed_load(source)
+            yield source_name(source), docs, seconds, None
+        except Exception as e:
+            yield source_name(source), [], 0.0, e
+
+    if not pooled:
+        return
+
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        # memoryview无法跨进程传递，只在此处复制一次
+        futures = {
+            pool.submit(_timed_load, (s[0], bytes(s[1])) if isinstance(s, tuple) else s): source_name(s)
+            for s in pooled
+        }
+        for future in as_completed(futures):
+            try:
+                docs, seconds = future.result()
+                yield futures[future], docs, seconds, None
+            except Exception as e:
+                yield futures[future], [], 0.0, e
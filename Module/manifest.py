@@ -0,0 +1,252 @@
+import hashlib
+import os
+import sqlite3
+import time
+from contextlib import closing
+from typing import NamedTuple
+
+MANIFEST_FILE = "ingestion_manifest.sqlite3"
+
+# 共享语料的作用域；其他作用域（如会话上传）的来源在清单中以 "作用域:内容哈希:来源" 为键
+SHARED_SCOPE = "shared"
+
+
+class FileRecord(NamedTuple):
+    source: str
+    file_hash: str
+    size: int
+    mtime: float
+
+
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(path, block_size=1 << 20):
+    """按块计算文件内容哈希，避免一次读入大文件"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def hash_documents(documents):
+    """没有原始文件时，用文档内容计算哈希"""
+    digest = hashlib.sha256()
+    for doc in documents:
+        digest.update(doc.page_content.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def scoped_source(source, scope=SHARED_SCOPE, file_hash=None):
+    """
+        清单中来源的键。
+
+    同名文件上传到不同作用域时分别入库，互不替换；上传的文件在键中带上内容哈希，
+    同一内容重复上传时复用已有的块，同名但内容不同的文件互不替换。
+    files目录中的文件没有作用域前缀和内容哈希，键即为路径。
+    """
+    prefix = "" if scope == SHARED_SCOPE else f"{scope}:"
+    if file_hash:
+        prefix += f"{file_hash[:16]}:"
+    return prefix + source
+
+
+def chunk_id(source, text):
+    """块ID由来源和块内容决定，内容不变则ID不变"""
+    return hashlib.sha1(f"{source}\0{text}".encode("utf-8")).hexdigest()
+
+
+class IngestionManifest:
+    """
+        记录已入库的文件哈希和块哈希。
+
+    files表按来源记录文件内容哈希和文件状态(size/mtime)，
+    chunks表记录每个来源当前在向量库中的块ID及产生该块的文件版本，
+    据此只写入新增的块并删除已变更或已删除文件的旧块。
+    checkpoints表记录分批入库的大文件已提交到的位置，用于中断后继续。
+    scopes表记录非共享作用域的过期时间，过期后其全部来源和向量被回收。
+    """
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, MANIFEST_FILE)
+        with closing(self._connect()) as conn, conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS files (
+                    source TEXT PRIMARY KEY,
+                    file_hash TEXT NOT NULL,
+                    size INTEGER NOT NULL DEFAULT 0,
+                    mtime REAL NOT NULL DEFAULT 0
+                );
+                CREATE TABLE IF NOT EXISTS chunks (
+                    chunk_id TEXT PRIMARY KEY,
+                    source TEXT NOT NULL,
+                    file_hash TEXT
+                );
+                CREATE INDEX IF NOT EXISTS chunks_source ON chunks (source);
+                CREATE TABLE IF NOT EXISTS checkpoints (
+                    source TEXT PRIMARY KEY,
+                    file_hash TEXT NOT NULL,
+                    position INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS scopes (
+                    scope TEXT PRIMARY KEY,
+                    expires_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                );
+            """)
+            # 旧版清单的chunks表没有file_hash列
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(chunks)")}
+            if "file_hash" not in columns:
+                conn.execute("ALTER TABLE chunks ADD COLUMN file_hash TEXT")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get_file(self, source):
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT source, file_hash, size, mtime FROM files WHERE source = ?", (source,)
+            ).fetchone()
+        return FileRecord(*row) if row else None
+
+    def sources(self):
+        with closing(self._connect()) as conn:
+            return {row[0] for row in conn.execute("SELECT source FROM files")}
+
+    def chunk_ids(self, source):
+        with closing(self._connect()) as conn:
+            return {row[0] for row in conn.execute("SELECT chunk_id FROM chunks WHERE source = ?", (source,))}
+
+    def touch(self, source, size, mtime):
+        """文件内容未变但状态变化时（如被重新保存），只更新size/mtime"""
+        with closing(self._connect()) as conn, conn:
+            conn.execute("UPDATE files SET size = ?, mtime = ? WHERE source = ?", (size, mtime, source))
+
+    def replace_file(self, source, file_hash, chunk_ids, size=0, mtime=0.0):
+        """
+            记录来源的新版本，返回需要从向量库中删除的旧块ID。
+        """
+        chunk_ids = set(chunk_ids)
+        with closing(self._connect()) as conn, conn:
+            old_ids = {row[0] for row in conn.execute("SELECT chunk_id FROM chunks WHERE source = ?", (source,))}
+            stale_ids = old_ids - chunk_ids
+            conn.executemany("DELETE FROM chunks WHERE chunk_id = ?", [(i,) for i in stale_ids])
+            conn.executemany(
+                "INSERT OR REPLACE INTO chunks (chunk_id, source, file_hash) VALUES (?, ?, ?)",
+                [(i, source, file_hash) for i in chunk_ids]
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO files (source, file_hash, size, mtime) VALUES (?, ?, ?, ?)",
+                (source, file_hash, size, mtime)
+            )
+        return stale_ids
+
+    def existing_chunk_ids(self, chunk_ids, batch_size=500):
+        """返回已记录的块ID，按批查询，避免把大文件的全部块ID读入内存"""
+        chunk_ids = list(chunk_ids)
+        existing = set()
+        with closing(self._connect()) as conn:
+            for start in range(0, len(chunk_ids), batch_size):
+                batch = chunk_ids[start:start + batch_size]
+                placeholders = ",".join("?" * len(batch))
+                existing.update(
+                    row[0] for row in
+                    conn.execute(f"SELECT chunk_id FROM chunks WHERE chunk_id IN ({placeholders})", batch)
+                )
+        return existing
+
+    def get_checkpoint(self, source, file_hash):
+        """返回同一文件版本上次提交到的位置，文件已变化时返回0"""
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT position FROM checkpoints WHERE source = ? AND file_hash = ?", (source, file_hash)
+            ).fetchone()
+        return row[0] if row else 0
+
+    def commit_batch(self, source, file_hash, chunk_ids, position):
+        """在一个事务中记录一批块和新的断点"""
+        with closing(self._connect()) as conn, conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO chunks (chunk_id, source, file_hash) VALUES (?, ?, ?)",
+                [(i, source, file_hash) for i in chunk_ids]
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO checkpoints (source, file_hash, position) VALUES (?, ?, ?)",
+                (source, file_hash, position)
+            )
+
+    def finish_file(self, source, file_hash, size=0, mtime=0.0):
+        """
+            分批入库完成后记录文件版本，返回不属于该版本、需要删除的旧块ID。
+        """
+        with closing(self._connect()) as conn, conn:
+            stale_ids = {
+                row[0] for row in conn.execute(
+                    "SELECT chunk_id FROM chunks WHERE source = ? AND file_hash IS NOT ?", (source, file_hash)
+                )
+            }
+            conn.execute("DELETE FROM chunks WHERE source = ? AND file_hash IS NOT ?", (source, file_hash))
+            conn.execute("DELETE FROM checkpoints WHERE source = ?", (source,))
+            conn.execute(
+                "INSERT OR REPLACE INTO files (source, file_hash, size, mtime) VALUES (?, ?, ?, ?)",
+                (source, file_hash, size, mtime)
+            )
+        return stale_ids
+
+    def remove_file(self, source):
+        """删除来源记录，返回其全部块ID"""
+        with closing(self._connect()) as conn, conn:
+            ids = {row[0] for row in conn.execute("SELECT chunk_id FROM chunks WHERE source = ?", (source,))}
+            conn.execute("DELETE FROM chunks WHERE source = ?", (source,))
+            conn.execute("DELETE FROM checkpoints WHERE source = ?", (source,))
+            conn.execute("DELETE FROM files WHERE source = ?", (source,))
+        return ids
+
+    def touch_scope(self, scope, ttl_seconds):
+        """作用域有活动时顺延过期时间"""
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO scopes (scope, expires_at) VALUES (?, ?)",
+                (scope, time.time() + ttl_seconds)
+            )
+
+    def expired_scopes(self):
+        with closing(self._connect()) as conn:
+            return [row[0] for row in conn.execute("SELECT scope FROM scopes WHERE expires_at < ?", (time.time(),))]
+
+    def scope_sources(self, scope):
+        """返回作用域中的全部来源键"""
+        prefix = scoped_source("", scope)
+        with closing(self._connect()) as conn:
+            return {
+                row[0] for row in conn.execute(
+                    "SELECT source FROM files WHERE substr(source, 1, length(?)) = ? "
+                    "UNION SELECT source FROM chunks WHERE substr(source, 1, length(?)) = ?",
+                    (prefix, prefix, prefix, prefix)
+                )
+            }
+
+    def drop_scope(self, scope):
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM scopes WHERE scope = ?", (scope,))
+
+    def corpus_version(self):
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'corpus_version'").fetchone()
+        return int(row[0]) if row else 0
+
+    def bump_corpus_version(self):
+        """语料发生变化时递增版本号"""
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT INTO meta (key, value) VALUES ('corpus_version', '1') "
+                "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1"
+            )
+        return self.corpus_version()
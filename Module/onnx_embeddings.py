@@ -0,0 +1,147 @@
+import json
+import os
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+ONNX_DIR = "onnx"
+ONNX_FILE = "model.onnx"
+ONNX_QUANTIZED_FILE = "model_int8.onnx"
+ONNX_INPUTS = ["input_ids", "attention_mask", "token_type_ids"]
+
+
+def onnx_model_path(model_dir, quantized=True):
+    return os.path.join(model_dir, ONNX_DIR, ONNX_QUANTIZED_FILE if quantized else ONNX_FILE)
+
+
+def export_onnx_model(model_dir, quantized=True):
+    """
+        将sentence-transformers模型目录中的Transformer导出为ONNX，可选再做int8动态量化。
+
+    导出只需要执行一次，结果保存在模型目录的onnx子目录中；需要torch、transformers，量化还需要onnx。
+
+    Returns:
+        str: 导出的ONNX文件路径
+    """
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    fp32_path = onnx_model_path(model_dir, quantized=False)
+    if not os.path.exists(fp32_path):
+        os.makedirs(os.path.dirname(fp32_path), exist_ok=True)
+        model = AutoModel.from_pretrained(model_dir).eval()
+
+        class Encoder(torch.nn.Module):
+            """按关键字参数调用模型，只输出last_hidden_state"""
+
+            def __init__(self):
+                super().__init__()
+                self.model = model
+
+            def forward(self, input_ids, attention_mask, token_type_ids):
+                return self.model(
+                    input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids
+                ).last_hidden_state
+
+        sample = AutoTokenizer.from_pretrained(model_dir)(["示例文本", "an example sentence"],
+                                                         padding=True, return_tensors="pt")
+        dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in ONNX_INPUTS + ["last_hidden_state"]}
+        with torch.no_grad():
+            torch.onnx.export(
+                Encoder(),
+                (sample["input_ids"], sample["attention_mask"], sample["token_type_ids"]),
+                fp32_path,
+                input_names=ONNX_INPUTS,
+                output_names=["last_hidden_state"],
+                dynamic_axes=dynamic_axes,
+                opset_version=14,
+                dynamo=False,
+            )
+
+    if not quantized:
+        return fp32_path
+
+    quantized_path = onnx_model_path(model_dir, quantized=True)
+    if not os.path.exists(quantized_path):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(fp32_path, quantized_path, weight_type=QuantType.QInt8)
+    return quantized_path
+
+
+class OnnxEmbeddings(Embeddings):
+    """
+        用onnxruntime在CPU上运行导出的ONNX模型，池化和归一化方式与原sentence-transformers模型一致。
+
+    池化方式读取模型目录中的1_Pooling/config.json，最大长度读取sentence_bert_config.json。
+    ONNX文件不存在时自动导出。
+    """
+
+    def __init__(self, model_dir, quantized=True, batch_size=32, normalize=True, threads=0):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        path = onnx_model_path(model_dir, quantized)
+        if not os.path.exists(path):
+            print(f"未找到ONNX模型，正在导出: {path}")
+            export_onnx_model(model_dir, quantized)
+
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self._session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self._input_names = {i.name for i in self._session.get_inputs()}
+
+        with open(os.path.join(model_dir, "sentence_bert_config.json"), encoding="utf-8") as f:
+            max_length = json.load(f).get("max_seq_length", 256)
+        with open(os.path.join(model_dir, "1_Pooling", "config.json"), encoding="utf-8") as f:
+            pooling = json.load(f)
+        if pooling.get("pooling_mode_cls_token"):
+            self._pooling = "cls"
+        elif pooling.get("pooling_mode_max_tokens"):
+            self._pooling = "max"
+        else:
+            self._pooling = "mean"
+
+        self._tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self._tokenizer.enable_truncation(max_length=max_length)
+        self._tokenizer.enable_padding(pad_id=self._tokenizer.token_to_id("[PAD]") or 0, pad_token="[PAD]")
+        self.batch_size = batch_size
+        self.normalize = normalize
+
+    def _pool(self, hidden, mask):
+        if self._pooling == "cls":
+            return hidden[:, 0]
+        mask = mask[:, :, None].astype(np.float32)
+        if self._pooling == "max":
+            return np.where(mask > 0, hidden, -1e9).max(axis=1)
+        return (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+    def _encode(self, texts):
+        encodings = self._tokenizer.encode_batch(texts)
+        inputs = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        hidden = self._session.run(None, {k: v for k, v in inputs.items() if k in self._input_names})[0]
+        vectors = self._pool(hidden, inputs["attention_mask"])
+        if self.normalize:
+            vectors = vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+        return vectors
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+        # 与HuggingFaceEmbeddings相同，编码前将换行替换为空格
+        texts = [text.replace("\n", " ") for text in texts]
+
+        # 按长度排序后分批，减少每批的填充长度
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        vectors = [None] * len(texts)
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            for i, vector in zip(batch, self._encode([texts[i] for i in batch])):
+                vectors[i] = vector
+        return np.vstack(vectors).tolist()
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
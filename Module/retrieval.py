@@ -0,0 +1,307 @@
+import numpy as np
+from langchain_core.documents import Document
+from Module.configuration import Configuration
+from Module.context import estimate_tokens
+from Module.manifest import SHARED_SCOPE
+from Module.vector_db import get_cross_encoder, get_embeddings, get_lexical_index, get_or_create_vector_db, \
+    session_scope
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def deduplicate_queries(queries, config=None):
+    """
+        合并语义重复的查询，保留每组中最先生成的一条。
+
+    用嵌入模型对查询编码，与已保留查询的余弦相似度不低于query_dedup_threshold的查询被丢弃。
+
+    Returns:
+        tuple: (保留的查询列表, 被合并的查询数)
+    """
+    configuration = Configuration.from_runnable_config(config)
+
+    # 先去掉空白和大小写不同的完全重复，不必编码
+    seen = set()
+    unique = []
+    for query in queries:
+        key = " ".join(query.split()).casefold()
+        if key and key not in seen:
+            seen.add(key)
+            unique.append(query.strip())
+    if len(unique) <= 1:
+        return unique, len(queries) - len(unique)
+
+    vectors = _normalize(np.asarray(get_embeddings(config).embed_documents(unique), dtype=np.float32))
+    kept = []
+    for i in range(len(unique)):
+        if not kept or np.max(vectors[kept] @ vectors[i]) < configuration.query_dedup_threshold:
+            kept.append(i)
+
+    return [unique[i] for i in kept], len(queries) - len(kept)
+
+
+def _to_document(doc_id, text, metadata, relevance_score, **scores):
+    # 向量库使用余弦距离，relevance_score始终为余弦相似度
+    return Document(
+        id=doc_id,
+        page_content=text,
+        metadata={**(metadata or {}), "relevance_score": relevance_score, **scores}
+    )
+
+
+def _fuse_rankings(rankings, rrf_k):
+    """倒数排名融合（RRF）：分数为各排名列表中 1/(rrf_k + 排名) 之和"""
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1 / (rrf_k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+def retrieval_scopes(configuration):
+    """检索范围内的作用域：共享语料（include_shared_corpus）和当前会话"""
+    scopes = [SHARED_SCOPE] if configuration.include_shared_corpus else []
+    if configuration.session_id:
+        scopes.append(session_scope(configuration.session_id))
+    return scopes
+
+
+def metadata_filter(configuration):
+    """
+        按检索范围构造向量库的where过滤条件。
+
+    Returns:
+        dict | None: Chroma的where条件；共享语料和会话都不在范围内时返回None，表示没有可检索的文档
+    """
+    scopes = retrieval_scopes(configuration)
+    if not scopes:
+        return None
+
+    conditions = [{"scope": {"$in": scopes}}]
+    if configuration.retrieval_upload_id:
+        conditions.append({"upload_id": configuration.retrieval_upload_id})
+    if configuration.retrieval_source:
+        conditions.append({"source": configuration.retrieval_source})
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+
+def _select_candidates(candidates, configuration):
+    """
+        从按排名排列的候选块中选出最终结果。
+
+    启用mmr_enabled时按最大边际相关性（MMR）依次选块：分数为 mmr_lambda × 相关性 − (1 − mmr_lambda) × 与已选块的
+    最大余弦相似度，重叠切块产生的近似重复块会排在后面。相关性为融合排名的归一化分数，纯向量检索时为余弦相似度。
+
+    启用retrieval_adaptive_k时块数不固定：至少保留retrieval_min_k个，最多retrieval_max_k个；其余块的余弦相似度
+    须不低于retrieval_score_cutoff，且所选块的总token数不超过retrieval_token_budget。否则固定取retrieval_k个。
+
+    Args:
+        candidates: (块ID, 文本, 元数据, 归一化向量, 余弦相似度, 融合相关性) 元组的列表，按排名排列
+
+    Returns:
+        list: 选中的候选，按选择顺序排列
+    """
+    if configuration.retrieval_adaptive_k:
+        limit = configuration.retrieval_max_k
+        minimum = min(configuration.retrieval_min_k, limit)
+        # 排名靠前的retrieval_min_k个块不受阈值限制
+        candidates = [
+            candidate for i, candidate in enumerate(candidates)
+            if i < minimum or candidate[4] >= configuration.retrieval_score_cutoff
+        ]
+    else:
+        limit = configuration.retrieval_k
+        minimum = limit
+
+    selected = []
+    selected_vectors = []
+    remaining = list(candidates)
+    used_tokens = 0
+    while remaining and len(selected) < limit:
+        if configuration.mmr_enabled and selected_vectors:
+            redundancy = np.max(np.stack([c[3] for c in remaining]) @ np.stack(selected_vectors).T, axis=1)
+            gains = [
+                configuration.mmr_lambda * candidate[5] - (1 - configuration.mmr_lambda) * overlap
+                for candidate, overlap in zip(remaining, redundancy)
+            ]
+            best = int(np.argmax(gains))
+        else:
+            best = 0
+        candidate = remaining.pop(best)
+
+        # 超出token预算的块跳过，继续尝试较短的块
+        cost = estimate_tokens(candidate[1])
+        if configuration.retrieval_adaptive_k and len(selected) >= minimum \
+                and used_tokens + cost > configuration.retrieval_token_budget:
+            continue
+        selected.append(candidate)
+        selected_vectors.append(candidate[3])
+        used_tokens += cost
+    return selected
+
+
+def retrieve_documents(queries, config=None):
+    """
+        批量检索：所有查询在一个批次中编码，并用一次向量库查询取回全部结果。
+
+    retrieval_mode为lexical或hybrid时同时查询BM25倒排索引；hybrid下两路各取hybrid_candidates个候选，
+    按RRF融合排名。候选块再经_select_candidates做MMR去冗余和自适应截断。每个文档的metadata中记录
+    relevance_score（余弦相似度），使用倒排索引时另记录bm25_score和rrf_score。
+    两路检索都只在metadata_filter限定的范围内进行。
+
+    Returns:
+        dict: 查询 -> 文档列表
+    """
+    configuration = Configuration.from_runnable_config(config)
+    queries = list(dict.fromkeys(queries))
+    if not queries:
+        return {}
+
+    vectorstore = get_or_create_vector_db(config)
+    collection = vectorstore._collection
+    total = collection.count()
+    where = metadata_filter(configuration)
+    limit = configuration.retrieval_max_k if configuration.retrieval_adaptive_k else configuration.retrieval_k
+    if min(limit, total) == 0 or where is None:
+        return {query: [] for query in queries}
+
+    # 只取固定数量的向量检索结果时不需要多取候选
+    mode = configuration.retrieval_mode
+    if mode == "vector" and not configuration.mmr_enabled:
+        candidates = limit
+    else:
+        candidates = max(configuration.hybrid_candidates, limit)
+
+    query_vectors = get_embeddings(config).embed_documents(queries)
+    rankings = {query: [] for query in queries}
+    chunks = {}
+    if mode in ("vector", "hybrid"):
+        results = collection.query(
+            query_embeddings=query_vectors,
+            n_results=min(candidates, total),
+            where=where,
+            include=["documents", "metadatas", "embeddings"]
+        )
+        for query, ids, texts, metadatas, vectors in zip(
+                queries, results["ids"], results["documents"], results["metadatas"], results["embeddings"]):
+            rankings[query] = ids
+            for doc_id, text, metadata, vector in zip(ids, texts, metadatas, vectors):
+                chunks[doc_id] = (text, metadata, vector)
+
+    lexical_hits = {query: {} for query in queries}
+    if mode in ("lexical", "hybrid"):
+        # 与向量检索相同的过滤条件在倒排索引的SQL中应用，只对范围内的块计分
+        lexical_index = get_lexical_index(vectorstore)
+        scopes = retrieval_scopes(configuration)
+        lexical_hits = {
+            query: dict(lexical_index.search(
+                query, candidates, scopes, configuration.retrieval_upload_id, configuration.retrieval_source
+            )) for query in queries
+        }
+
+    # 纯向量检索按余弦排名，否则按RRF融合排名
+    if mode == "vector":
+        fused = {query: [(doc_id, None) for doc_id in rankings[query]] for query in queries}
+    else:
+        fused = {
+            query: _fuse_rankings([rankings[query], list(lexical_hits[query])], configuration.rrf_k)[:candidates]
+            for query in queries
+        }
+
+    # 仅被BM25命中的块取回内容和向量，统一计算余弦相似度
+    missing = list(dict.fromkeys(
+        doc_id for ranking in fused.values() for doc_id, _ in ranking if doc_id not in chunks
+    ))
+    if missing:
+        stored = collection.get(ids=missing, include=["embeddings", "documents", "metadatas"])
+        for doc_id, vector, text, metadata in zip(
+                stored["ids"], stored["embeddings"], stored["documents"], stored["metadatas"]):
+            chunks[doc_id] = (text, metadata, vector)
+
+    retrieved = {}
+    for query, query_vector in zip(queries, _normalize(np.asarray(query_vectors, dtype=np.float32))):
+        # 倒排索引中残留但向量库已删除的块
+        ranking = [(doc_id, rrf_score) for doc_id, rrf_score in fused[query] if doc_id in chunks]
+        if not ranking:
+            retrieved[query] = []
+            continue
+
+        vectors = _normalize(np.asarray([chunks[doc_id][2] for doc_id, _ in ranking], dtype=np.float32))
+        similarities = vectors @ query_vector
+        if mode == "vector":
+            relevance = similarities
+        else:
+            relevance = np.array([rrf_score for _, rrf_score in ranking]) / ranking[0][1]
+        candidates_for_query = [
+            (doc_id, chunks[doc_id][0], chunks[doc_id][1], vector, float(similarity), float(rel))
+            for (doc_id, _), vector, similarity, rel in zip(ranking, vectors, similarities, relevance)
+        ]
+
+        rrf_scores = dict(ranking)
+        retrieved[query] = [
+            _to_document(doc_id, text, metadata, similarity)
+            if mode == "vector" else
+            _to_document(
+                doc_id, text, metadata, similarity,
+                bm25_score=float(lexical_hits[query].get(doc_id, 0.0)),
+                rrf_score=rrf_scores[doc_id]
+            )
+            for doc_id, text, metadata, _, similarity, _ in _select_candidates(candidates_for_query, configuration)
+        ]
+    return retrieved
+
+
+def score_documents(query, documents, config=None):
+    """
+        返回每个文档与查询的相关性分数。
+
+    配置了交叉编码器时使用其输出的概率，否则使用检索时记录的余弦相似度relevance_score。
+    """
+    cross_encoder = get_cross_encoder(config)
+    if cross_encoder is not None and documents:
+        scores = cross_encoder.predict([(query, doc.page_content) for doc in documents])
+        return [float(score) for score in scores]
+    return [doc.metadata.get("relevance_score") for doc in documents]
+
+
+def relevance_gate(scores, config=None):
+    """
+        根据分数判断文档是否相关。
+
+    最高分不低于relevance_high_threshold时为相关，低于relevance_low_threshold时为不相关，
+    处于两者之间或没有分数时返回None，交由LLM评估。
+    """
+    configuration = Configuration.from_runnable_config(config)
+    if not scores:
+        return False
+    if any(score is None for score in scores):
+        return None
+
+    best = max(scores)
+    if best >= configuration.relevance_high_threshold:
+        return True
+    if best < configuration.relevance_low_threshold:
+        return False
+    return None
+
+
+def grade_documents(query, documents, config=None):
+    """
+        逐个文档评分，只保留分数不低于relevance_document_threshold的文档。
+
+    Returns:
+        tuple: (保留的文档列表, 覆盖率 = 保留数 / 检索数)
+    """
+    configuration = Configuration.from_runnable_config(config)
+    if not documents:
+        return [], 0.0
+
+    scores = score_documents(query, documents, config)
+    kept = [
+        doc for doc, score in zip(documents, scores)
+        if score is not None and score >= configuration.relevance_document_threshold
+    ]
+    return kept, len(kept) / len(documents)
@@ -5,9 +5,12 @@ from typing_extensions import TypedDict
 
 class ResearcherState(TypedDict):
     user_instructions: str
+    answer_cache_hit: bool
+    corpus_version: int
     research_queries: list[str]
+    saved_branches: int
+    prefetched_documents: dict[str, list]
     search_summaries: Annotated[list, operator.add]
-    current_position: int
     final_answer: str
 
 
@@ -17,6 +20,7 @@ class ResearcherStateInput(TypedDict):
 
 class ResearcherStateOutput(TypedDict):
     final_answer: str
+    answer_cache_hit: bool
 
 
 class QuerySearchState(TypedDict):
@@ -24,11 +28,13 @@ class QuerySearchState(TypedDict):
     web_search_results: list
     retrieved_documents: list
     are_documents_relevant: bool
+    needs_web_search: bool
     search_summaries: list[str]
 
 
 class QuerySearchStateInput(TypedDict):
     query: str
+    retrieved_documents: list
 
 
 class QuerySearchStateOutput(TypedDict):
@@ -1,11 +1,20 @@
+import asyncio
+import copy
 import os
-import re
-import shutil
-from ollama import chat
-from tavily import TavilyClient
+import threading
+import time
+import uuid
+import weakref
+from contextlib import asynccontextmanager, contextmanager
+import httpx
+from ollama import AsyncClient, Client
+from tavily import AsyncTavilyClient, TavilyClient
 from pydantic import BaseModel
-from langchain_community.document_loaders import CSVLoader, TextLoader, PDFPlumberLoader
-from Module.vector_db import add_documents
+from Module.cache import SearchAbandonedError, get_search_cache
+from Module.configuration import Configuration
+from Module.loaders import is_supported
+from Module.manifest import SHARED_SCOPE, hash_bytes
+from Module.vector_db import collect_expired_scopes, ingest_files, session_scope, touch_scope
 
 class Evaluation(BaseModel):
     is_relevant: bool
@@ -13,13 +22,117 @@ class Evaluation(BaseModel):
 class Queries(BaseModel):
     queries: list[str]
 
+def _partial_suffix(text, tag):
+    """text末尾可能是tag开头部分的最大长度"""
+    for size in range(min(len(tag) - 1, len(text)), 0, -1):
+        if text.endswith(tag[:size]):
+            return size
+    return 0
+
+
+class ReasoningParser:
+    """
+        单遍、增量地将推理模型的输出拆分为推理(<think>...</think>)和回答。
+
+    按块调用feed，返回可以立即显示的回答文本；结束时调用close取回剩余部分。
+    没有<think>标签时全部为回答；<think>未闭合（输出被截断）时全部为推理；
+    只有</think>而没有开始标签时，之前的内容归为推理（此前已返回的增量无法撤回，以response为准）。
+    """
+
+    OPEN_TAG = "<think>"
+    CLOSE_TAG = "</think>"
+
+    def __init__(self):
+        self._pending = ""
+        self._state = "start"
+        self._closed = False
+        self._reasoning = []
+        self._response = []
+
+    def feed(self, chunk):
+        self._pending += chunk
+        emitted = []
+        while self._pending:
+            if self._state == "start":
+                stripped = self._pending.lstrip()
+                if stripped.startswith(self.OPEN_TAG):
+                    self._pending = stripped[len(self.OPEN_TAG):]
+                    self._state = "think"
+                    continue
+                self._pending = stripped
+                if self.OPEN_TAG.startswith(stripped):
+                    # 可能是被拆开的开始标签，等待更多输入
+                    break
+                self._state = "response"
+
+            elif self._state == "think":
+                end = self._pending.find(self.CLOSE_TAG)
+                if end < 0:
+                    keep = _partial_suffix(self._pending, self.CLOSE_TAG)
+                    self._reasoning.append(self._pending[:len(self._pending) - keep])
+                    self._pending = self._pending[len(self._pending) - keep:]
+                    break
+                self._reasoning.append(self._pending[:end])
+                self._pending = self._pending[end + len(self.CLOSE_TAG):]
+                self._closed = True
+                self._state = "after_think"
+
+            elif self._state == "after_think":
+                # 跳过</think>之后的空白
+                self._pending = self._pending.lstrip()
+                if self._pending:
+                    self._state = "response"
+
+            else:
+                keep = 0
+                if not self._closed:
+                    end = self._pending.find(self.CLOSE_TAG)
+                    if end >= 0:
+                        # 缺少开始标签：此前的内容都是推理
+                        self._reasoning = self._response + [self._pending[:end]]
+                        self._response = []
+                        self._pending = self._pending[end + len(self.CLOSE_TAG):]
+                        self._closed = True
+                        self._state = "after_think"
+                        continue
+                    keep = _partial_suffix(self._pending, self.CLOSE_TAG)
+                text = self._pending[:len(self._pending) - keep]
+                self._pending = self._pending[len(self._pending) - keep:]
+                self._response.append(text)
+                emitted.append(text)
+                break
+
+        return "".join(emitted)
+
+    def close(self):
+        """输入结束，返回剩余的回答文本"""
+        pending, self._pending = self._pending, ""
+        if self._state == "think":
+            self._reasoning.append(pending)
+            return ""
+        if self._state in ("start", "response"):
+            self._response.append(pending)
+            return pending
+        return ""
+
+    @property
+    def reasoning(self):
+        return "".join(self._reasoning).strip()
+
+    @property
+    def response(self):
+        return "".join(self._response).strip()
+
+
 def parse_output(text):
-    think = re.search(r'<think>(.*?)</think>', text, re.DOTALL).group(1).strip()
-    output = re.search(r'</think>\s*(.*?)$', text, re.DOTALL).group(1).strip()
+    """拆分推理和回答，标签缺失或未闭合时不会抛出异常"""
+    parser = ReasoningParser()
+    parser.feed(text)
+    parser.close()
 
     return {
-        "reasoning": think,
-        "response": output
+        "reasoning": parser.reasoning,
+        "response": parser.response
     }
 
 def format_documents_with_metadata(documents):
@@ -40,56 +153,382 @@ def format_documents_with_metadata(documents):
 
     return "\n\n---\n\n".join(formatted_docs)
 
-def invoke_ollama(model, system_prompt, user_prompt, output_format=None):
+class LLMBackend:
+    """
+        一个LLM后端（如Ollama、OpenRouter）共享的客户端、并发上限和耗时统计。
+
+    同步调用和异步调用分别使用线程信号量和每个事件循环各自的信号量限制在途请求数，
+    统计中queue_wait_seconds为等待信号量的时间，generation_seconds为请求本身的时间。
+    """
+
+    def __init__(self, name, max_concurrency):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._async_semaphores = weakref.WeakKeyDictionary()
+        self._clients = {}
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self._stats = {
+            "requests": 0,
+            "errors": 0,
+            "in_flight": 0,
+            "max_in_flight": 0,
+            "queue_wait_seconds": 0.0,
+            "generation_seconds": 0.0,
+        }
+
+    def client(self, key, factory):
+        """按key缓存同步客户端，复用底层HTTP连接"""
+        with self._lock:
+            if key not in self._clients:
+                self._clients[key] = factory()
+            return self._clients[key]
+
+    def async_client(self, key, factory):
+        """异步客户端的连接绑定在事件循环上，按事件循环分别缓存"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            clients = self._async_clients.setdefault(loop, {})
+            if key not in clients:
+                clients[key] = factory()
+            return clients[key]
+
+    def _start(self, queue_wait):
+        with self._lock:
+            self._stats["requests"] += 1
+            self._stats["queue_wait_seconds"] += queue_wait
+            self._stats["in_flight"] += 1
+            self._stats["max_in_flight"] = max(self._stats["max_in_flight"], self._stats["in_flight"])
+
+    def _finish(self, generation, failed):
+        with self._lock:
+            self._stats["in_flight"] -= 1
+            self._stats["generation_seconds"] += generation
+            self._stats["errors"] += int(failed)
+
+    @contextmanager
+    def slot(self):
+        start = time.perf_counter()
+        with self._semaphore:
+            acquired = time.perf_counter()
+            self._start(acquired - start)
+            failed = True
+            try:
+                yield
+                failed = False
+            finally:
+                self._finish(time.perf_counter() - acquired, failed)
+
+    @asynccontextmanager
+    async def aslot(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            semaphore = self._async_semaphores.setdefault(loop, asyncio.Semaphore(self.max_concurrency))
+        start = time.perf_counter()
+        async with semaphore:
+            acquired = time.perf_counter()
+            self._start(acquired - start)
+            failed = True
+            try:
+                yield
+                failed = False
+            finally:
+                self._finish(time.perf_counter() - acquired, failed)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, max_concurrency=self.max_concurrency)
+
+
+_backends_lock = threading.Lock()
+_backends = {}
+
+
+def get_backend(name):
+    """获取后端，首次使用时按配置创建；Ollama的并发上限与服务端并行数一致"""
+    with _backends_lock:
+        if name not in _backends:
+            configuration = Configuration.from_runnable_config()
+            max_concurrency = configuration.ollama_num_parallel if name == "ollama" \
+                else configuration.openrouter_max_concurrency
+            _backends[name] = LLMBackend(name, max(1, max_concurrency))
+        return _backends[name]
+
+
+def get_llm_stats():
+    """返回各后端的请求数、在途请求数、排队等待和生成耗时"""
+    with _backends_lock:
+        backends = dict(_backends)
+    return {name: backend.stats() for name, backend in backends.items()}
+
+
+def _http_limits(backend):
+    return httpx.Limits(
+        max_connections=backend.max_concurrency * 2,
+        max_keepalive_connections=backend.max_concurrency
+    )
+
+
+def _ollama_client(backend):
+    # host为None时使用OLLAMA_HOST环境变量
+    return backend.client("client", lambda: Client(limits=_http_limits(backend)))
+
+
+def _async_ollama_client(backend):
+    return backend.async_client("client", lambda: AsyncClient(limits=_http_limits(backend)))
+
+
+def _parse_response(content, output_format):
+    if output_format:
+        return output_format.model_validate_json(content)
+    return content
+
+
+def invoke_ollama(model, system_prompt, user_prompt, output_format=None, cache=None):
     messages = [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": user_prompt}
     ]
-    response = chat(
-        messages=messages,
-        model=model,
-        format=output_format.model_json_schema() if output_format else None
-    )
 
-    if output_format:
-        return output_format.model_validate_json(response.message.content)
-    else:
-        return response.message.content
+    # 命中缓存时直接返回，cache为None时不使用缓存
+    key = cache.make_key("ollama", model, messages, output_format) if cache else None
+    content = cache.get(key) if cache else None
+    if content is not None:
+        return _parse_response(content, output_format)
+
+    backend = get_backend("ollama")
+    with backend.slot():
+        response = _ollama_client(backend).chat(
+            messages=messages,
+            model=model,
+            format=output_format.model_json_schema() if output_format else None
+        )
+
+    # 解析成功后再写入缓存，避免缓存格式错误的响应
+    result = _parse_response(response.message.content, output_format)
+    if cache:
+        cache.put(key, response.message.content)
+    return result
+
+async def ainvoke_ollama(model, system_prompt, user_prompt, output_format=None, cache=None):
+    """invoke_ollama的异步版本，等待Ollama响应时不阻塞事件循环"""
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+
+    key = cache.make_key("ollama", model, messages, output_format) if cache else None
+    content = await asyncio.to_thread(cache.get, key) if cache else None
+    if content is not None:
+        return _parse_response(content, output_format)
+
+    backend = get_backend("ollama")
+    async with backend.aslot():
+        response = await _async_ollama_client(backend).chat(
+            messages=messages,
+            model=model,
+            format=output_format.model_json_schema() if output_format else None
+        )
+
+    result = _parse_response(response.message.content, output_format)
+    if cache:
+        await asyncio.to_thread(cache.put, key, response.message.content)
+    return result
+
+def stream_ollama(model, system_prompt, user_prompt, cache=None):
+    """
+        流式调用Ollama，逐块返回生成的文本。
+
+    完整响应在生成结束后写入缓存；命中缓存时一次返回完整文本。
+    """
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+
+    key = cache.make_key("ollama", model, messages) if cache else None
+    content = cache.get(key) if cache else None
+    if content is not None:
+        yield content
+        return
+
+    backend = get_backend("ollama")
+    chunks = []
+    with backend.slot():
+        for part in _ollama_client(backend).chat(messages=messages, model=model, stream=True):
+            chunks.append(part.message.content)
+            yield part.message.content
+
+    if cache:
+        cache.put(key, "".join(chunks))
+
+async def astream_ollama(model, system_prompt, user_prompt, cache=None):
+    """stream_ollama的异步版本"""
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+
+    key = cache.make_key("ollama", model, messages) if cache else None
+    content = await asyncio.to_thread(cache.get, key) if cache else None
+    if content is not None:
+        yield content
+        return
+
+    backend = get_backend("ollama")
+    chunks = []
+    async with backend.aslot():
+        async for part in await _async_ollama_client(backend).chat(messages=messages, model=model, stream=True):
+            chunks.append(part.message.content)
+            yield part.message.content
+
+    if cache:
+        await asyncio.to_thread(cache.put, key, "".join(chunks))
+
+def _build_llm(backend, model, output_format, temperature, use_async=False):
+    """按 (模型, 温度, 输出格式) 缓存ChatOpenAI，复用其HTTP连接池"""
+    from langchain_openai import ChatOpenAI
+
+    def factory():
+        http_client_kwargs = {"limits": _http_limits(backend)}
+        llm = ChatOpenAI(
+            model=model,
+            temperature=temperature,
+            openai_api_key=os.getenv("OPENROUTER_API_KEY"),
+            openai_api_base= "https://openrouter.ai/api/v1",
+            **({"http_async_client": httpx.AsyncClient(**http_client_kwargs)} if use_async
+               else {"http_client": httpx.Client(**http_client_kwargs)})
+        )
+
+        # 如果提供了响应格式，使用结构化输出
+        if output_format:
+            llm = llm.with_structured_output(output_format)
+        return llm
+
+    key = (model, temperature, output_format)
+    return backend.async_client(key, factory) if use_async else backend.client(key, factory)
     
+def _response_content(response, output_format):
+    """结构化输出序列化为JSON，文本输出取content，用于写入缓存"""
+    return response.model_dump_json() if output_format else response.content
+
 def invoke_llm(
     model,
     system_prompt,
     user_prompt,
     output_format=None,
-    temperature=0
+    temperature=0,
+    cache=None
 ):
-        
-    from langchain_openai import ChatOpenAI
-    llm = ChatOpenAI(
-        model=model, 
-        temperature=temperature,
-        openai_api_key=os.getenv("OPENROUTER_API_KEY"),
-        openai_api_base= "https://openrouter.ai/api/v1",
-    )
-    
-    # 如果提供了响应格式，使用结构化输出
-    if output_format:
-        llm = llm.with_structured_output(output_format)
-    
     # Invoke LLM
     messages = [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": user_prompt}
     ]
-    response = llm.invoke(messages)
-    
+
+    key = cache.make_key("openrouter", model, messages, output_format, temperature) if cache else None
+    content = cache.get(key) if cache else None
+    if content is not None:
+        return _parse_response(content, output_format)
+
+    backend = get_backend("openrouter")
+    llm = _build_llm(backend, model, output_format, temperature)
+    with backend.slot():
+        response = llm.invoke(messages)
+
+    if cache:
+        cache.put(key, _response_content(response, output_format))
     if output_format:
         return response
     return response.content # str response
 
+async def ainvoke_llm(
+    model,
+    system_prompt,
+    user_prompt,
+    output_format=None,
+    temperature=0,
+    cache=None
+):
+    """invoke_llm的异步版本"""
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+
+    key = cache.make_key("openrouter", model, messages, output_format, temperature) if cache else None
+    content = await asyncio.to_thread(cache.get, key) if cache else None
+    if content is not None:
+        return _parse_response(content, output_format)
+
+    backend = get_backend("openrouter")
+    llm = _build_llm(backend, model, output_format, temperature, use_async=True)
+    async with backend.aslot():
+        response = await llm.ainvoke(messages)
+
+    if cache:
+        await asyncio.to_thread(cache.put, key, _response_content(response, output_format))
+    if output_format:
+        return response
+    return response.content
+
+class TavilySearchBackend:
+    """默认搜索后端：复用同一个TavilyClient，异步客户端按事件循环复用"""
+
+    def __init__(self):
+        self._client = None
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    def search(self, query, max_results, include_raw_content):
+        if self._client is None:
+            self._client = TavilyClient()
+        return self._client.search(query, max_results=max_results, include_raw_content=include_raw_content)
+
+    async def asearch(self, query, max_results, include_raw_content):
+        loop = asyncio.get_running_loop()
+        if loop not in self._async_clients:
+            self._async_clients[loop] = AsyncTavilyClient()
+        return await self._async_clients[loop].search(
+            query, max_results=max_results, include_raw_content=include_raw_content
+        )
+
+
+class StaticSearchBackend:
+    """
+        本地替身搜索后端，不访问网络，用于测试和离线运行。
+
+    Args:
+        responder: 函数 responder(query, max_results, include_raw_content)，返回搜索结果字典的列表
+    """
+
+    def __init__(self, responder):
+        self.responder = responder
+        self.calls = 0
+
+    def search(self, query, max_results, include_raw_content):
+        self.calls += 1
+        return {"query": query, "results": self.responder(query, max_results, include_raw_content)}
+
+    async def asearch(self, query, max_results, include_raw_content):
+        return self.search(query, max_results, include_raw_content)
+
+
+_search_backend = TavilySearchBackend()
+
+
+def set_search_backend(backend):
+    """替换搜索后端（如StaticSearchBackend），返回原来的后端"""
+    global _search_backend
+    previous, _search_backend = _search_backend, backend
+    return previous
+
+
 def tavily_search(query, include_raw_content=True, max_results=3):
     """ 使用Tavily API联网搜索
 
+    相同的规范化查询和参数在有效期内直接返回缓存结果，并发的相同查询只发出一次请求。
+
     Args:
         query (str)：执行的搜索查询
         include_raw_content (bool)：是否在格式化字符串中包含来自Tavily的raw_content
@@ -103,12 +542,58 @@ def tavily_search(query, include_raw_content=True, max_results=3):
                 - content (str): 内容的片段/摘要
                 - raw_content (str): 页面的完整内容，需判断可用"""
 
-    tavily_client = TavilyClient()
-    return tavily_client.search(
-        query,
-        max_results=max_results,
-        include_raw_content=include_raw_content
-    )
+    search_cache = get_search_cache(Configuration.from_runnable_config())
+    key = search_cache.make_key(query, max_results=max_results, include_raw_content=include_raw_content)
+    while True:
+        cached, future, is_leader = search_cache.begin(key)
+        if cached is not None:
+            return cached
+        if is_leader:
+            break
+        try:
+            return copy.deepcopy(future.result())
+        except SearchAbandonedError:
+            # 发出请求的调用被取消，重新发起
+            continue
+
+    try:
+        result = _search_backend.search(query, max_results, include_raw_content)
+    except Exception as e:
+        search_cache.finish(key, future, error=e)
+        raise
+    except BaseException:
+        search_cache.finish(key, future, error=SearchAbandonedError(query))
+        raise
+    search_cache.finish(key, future, result)
+    return copy.deepcopy(result)
+
+async def atavily_search(query, include_raw_content=True, max_results=3):
+    """tavily_search的异步版本，参数和返回值相同"""
+    search_cache = get_search_cache(Configuration.from_runnable_config())
+    key = search_cache.make_key(query, max_results=max_results, include_raw_content=include_raw_content)
+    while True:
+        cached, future, is_leader = search_cache.begin(key)
+        if cached is not None:
+            return cached
+        if is_leader:
+            break
+        try:
+            # shield：等待方被取消时不取消共享的future
+            return copy.deepcopy(await asyncio.shield(asyncio.wrap_future(future)))
+        except SearchAbandonedError:
+            continue
+
+    try:
+        result = await _search_backend.asearch(query, max_results, include_raw_content)
+    except Exception as e:
+        search_cache.finish(key, future, error=e)
+        raise
+    except BaseException:
+        # 被取消（如客户端断开）时也要结束在途请求，否则后续相同查询会一直等待
+        search_cache.finish(key, future, error=SearchAbandonedError(query))
+        raise
+    search_cache.finish(key, future, result)
+    return copy.deepcopy(result)
 
 def get_report_structures(reports_folder="reply template"):
     """
@@ -141,33 +626,37 @@ def get_report_structures(reports_folder="reply template"):
 
     return report_structures
 
-def process_uploaded_files(uploaded_files):
-    temp_folder = "temp_files"
-    os.makedirs(temp_folder, exist_ok=True)
+def process_uploaded_files(uploaded_files, progress=None, session_id=None):
+    """
+        直接从上传文件的内存缓冲区解析并批量入库，不写临时文件。
+
+    指定session_id时文档写入该会话的作用域，只有该会话能检索到，会话过期后被回收；否则写入共享语料。
 
-    try:
-        for uploaded_file in uploaded_files:
-            file_extension = uploaded_file.name.split(".")[-1].lower()
-            temp_file_path = os.path.join(temp_folder, uploaded_file.name)
-
-            with open(temp_file_path, "wb") as f:
-                f.write(uploaded_file.getvalue())
-
-            # 选择合适的加载程序
-            if file_extension == "csv":
-                loader = CSVLoader(temp_file_path)
-            elif file_extension in ["txt", "md"]:
-                loader = TextLoader(temp_file_path)
-            elif file_extension == "pdf":
-                loader = PDFPlumberLoader(temp_file_path)
-            else:
-                continue
+    Args:
+        uploaded_files: Streamlit上传的文件列表
+        progress: 可选的回调 progress(文件名, stage, seconds)，用于在界面上显示每个文件的进度
+        session_id (str)：可选的会话ID
+
+    Returns:
+        str: 本次上传的批次ID，可用于retrieval_upload_id过滤
+    """
+    sources = []
+    file_info = {}
+    for uploaded_file in uploaded_files:
+        if not is_supported(uploaded_file.name):
+            continue
+
+        # getbuffer() 返回内存视图，不复制上传内容
+        buffer = uploaded_file.getbuffer()
+        sources.append((uploaded_file.name, buffer))
+        file_info[uploaded_file.name] = (hash_bytes(buffer), buffer.nbytes, 0.0)
+
+    scope = session_scope(session_id) if session_id else SHARED_SCOPE
+    upload_id = uuid.uuid4().hex
+    collect_expired_scopes()
+    touch_scope(scope)
 
-            # 加载和追加文档
-            docs = loader.load()
-            add_documents(docs)
+    # 文本直接解析，PDF在进程池中并行解析，再统一切块、编码和写入
+    ingest_files(sources, file_info=file_info, progress=progress, scope=scope, upload_id=upload_id)
 
-        return True
-    finally:
-        # 删除临时文件夹及其内容
-        shutil.rmtree(temp_folder, ignore_errors=True)
\ No newline at end of file
+    return upload_id
@@ -1,65 +1,781 @@
 import os
-from langchain_community.document_loaders import DirectoryLoader
-from langchain_experimental.text_splitter import SemanticChunker 
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+import threading
+import time
+import numpy as np
 from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_chroma import Chroma
+from Module.cache import CACHE_PATH, CachedEmbeddings
+from Module.chunking import ENCODE_BATCH_SIZE, chunk_documents, count_units
+from Module.configuration import Configuration
+from Module.loaders import STREAMABLE_EXTENSIONS, file_extension, is_supported, iter_loaded_files, \
+    iter_stream_documents, source_name, source_size
+from Module.lexical import LexicalIndex
+from Module.manifest import SHARED_SCOPE, IngestionManifest, chunk_id, hash_bytes, hash_documents, hash_file, \
+    scoped_source
+from Module.onnx_embeddings import OnnxEmbeddings
 
 VECTOR_DB_PATH = "database"
- 
-def get_or_create_vector_db():
-    """获取或创建向量库"""
-    embeddings = HuggingFaceEmbeddings(model_name='D:/work/pycharm/Project/ChatBot/all-MiniLM-L6-v2')
-
-    if os.path.exists(VECTOR_DB_PATH) and os.listdir(VECTOR_DB_PATH):
-        # 使用存在的 vector store
-        vectorstore = Chroma(persist_directory=VECTOR_DB_PATH, embedding_function=embeddings)
-    else:
-        # 加载文档后建立新词向量库
-        loader = DirectoryLoader("D:/work/pycharm/Project/ChatBot/files")
-        docs = loader.load()
-
-        # 处理新文档
-        semantic_text_splitter = SemanticChunker(embeddings)
-        documents = semantic_text_splitter.split_documents(docs)
-
-        # 将结果文档拆分为更小的块
-        # 使用RecursiveCharacterTextSplitter来设置块大小
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=2000, chunk_overlap=400)
-        split_documents = text_splitter.split_documents(documents)
-        vectorstore = Chroma.from_documents(split_documents, embeddings, persist_directory=VECTOR_DB_PATH)
+FILES_PATH = "files"
+UPSERT_BATCH_SIZE = 1000
+
+# 流式入库时一批的内存估算：每个字符（文档文本和块文本），以及每个切分单元
+# （float32句向量、池化后的块向量、Document和元数据等对象），用于由内存上限决定每批的大小
+STREAM_BYTES_PER_CHAR = 8
+STREAM_BYTES_PER_UNIT = 3072
+# 嵌入模型返回的每个Python浮点数（对象24字节 + 列表指针8字节），编码子批次期间临时占用
+STREAM_BYTES_PER_LIST_FLOAT = 32
+
+# 进程级共享的嵌入模型和向量库句柄，避免每次查询都重新加载
+# _registry_lock只保护按键创建加载锁，_stats_lock只保护计数，加载在各键自己的锁内进行
+_registry_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_load_locks = {}
+_embeddings_registry = {}
+_vector_db_registry = {}
+_manifest_registry = {}
+_cross_encoder_registry = {}
+_lexical_registry = {}
+_synced_paths = set()
+
+# 同一进程内的入库操作串行执行，避免同一来源被并发写入
+_ingest_lock = threading.RLock()
+_registry_stats = {
+    "embedding_loads": 0,
+    "embedding_load_seconds": 0.0,
+    "vector_db_loads": 0,
+    "vector_db_load_seconds": 0.0,
+    "manifest_loads": 0,
+    "manifest_load_seconds": 0.0,
+    "cross_encoder_loads": 0,
+    "cross_encoder_load_seconds": 0.0,
+    "lexical_index_loads": 0,
+    "lexical_index_load_seconds": 0.0,
+    "hits": 0,
+    "misses": 0,
+}
+
+
+class EmbeddingModelMismatchError(RuntimeError):
+    """向量库记录的嵌入模型与当前配置不一致"""
+
+
+def _count(**increments):
+    with _stats_lock:
+        for name, value in increments.items():
+            _registry_stats[name] += value
+
+
+def _get_or_load(registry, key, loader, stat_prefix):
+    """双重检查加锁：命中时不等待任何加载，未命中时按键加锁只加载一次，
+    不同键的加载互不阻塞"""
+    instance = registry.get(key)
+    if instance is not None:
+        _count(hits=1)
+        return instance
+
+    with _registry_lock:
+        load_lock = _load_locks.setdefault((stat_prefix, key), threading.Lock())
+
+    with load_lock:
+        instance = registry.get(key)
+        if instance is not None:
+            _count(hits=1)
+            return instance
+
+        start = time.perf_counter()
+        instance = loader()
+        registry[key] = instance
+        _count(**{
+            "misses": 1,
+            f"{stat_prefix}_loads": 1,
+            f"{stat_prefix}_load_seconds": time.perf_counter() - start,
+        })
+        return instance
+
+
+def embedding_model_id(configuration):
+    """向量库中记录的模型标识，与本地路径无关"""
+    model_name = os.path.basename(os.path.normpath(configuration.embedding_model))
+    return f"{model_name}|normalize={configuration.embedding_normalize}"
+
+
+def _embedding_key(configuration):
+    return (
+        configuration.embedding_model,
+        configuration.embedding_device,
+        configuration.embedding_batch_size,
+        configuration.embedding_normalize,
+        configuration.embedding_backend,
+        configuration.embedding_onnx_quantized,
+        configuration.embedding_cache_enabled,
+        configuration.embedding_cache_max_entries,
+        configuration.embedding_cache_persist,
+    )
+
+
+def _load_embeddings(configuration):
+    embeddings = _load_embedding_model(configuration)
+    if not configuration.embedding_cache_enabled:
+        return embeddings
+
+    # 量化模型的向量与原模型略有差异，缓存按后端区分
+    model_id = f"{embedding_model_id(configuration)}|{configuration.embedding_backend}"
+    if configuration.embedding_backend == "onnx":
+        model_id += f"|int8={configuration.embedding_onnx_quantized}"
+    return CachedEmbeddings(
+        embeddings,
+        model_id,
+        max_entries=configuration.embedding_cache_max_entries,
+        path=os.path.join(CACHE_PATH, "embeddings.sqlite3") if configuration.embedding_cache_persist else None
+    )
+
+
+def _load_embedding_model(configuration):
+    if configuration.embedding_backend == "onnx":
+        return OnnxEmbeddings(
+            configuration.embedding_model,
+            quantized=configuration.embedding_onnx_quantized,
+            batch_size=configuration.embedding_batch_size,
+            normalize=configuration.embedding_normalize,
+        )
+    return HuggingFaceEmbeddings(
+        model_name=configuration.embedding_model,
+        model_kwargs={"device": configuration.embedding_device},
+        encode_kwargs={
+            "batch_size": configuration.embedding_batch_size,
+            "normalize_embeddings": configuration.embedding_normalize,
+        },
+    )
+
+
+def embedding_dimension(config=None):
+    """嵌入向量的维度"""
+    embeddings = get_embeddings(config)
+    model = getattr(getattr(embeddings, "embeddings", embeddings), "_client", None)
+    # sentence-transformers 5起方法名改为get_embedding_dimension
+    for method in ("get_embedding_dimension", "get_sentence_embedding_dimension"):
+        if hasattr(model, method):
+            return getattr(model, method)()
+    return len(embeddings.embed_query("dimension"))
+
+
+def get_embeddings(config=None):
+    """获取进程内共享的嵌入模型，入库和检索使用同一个实例"""
+    configuration = Configuration.from_runnable_config(config)
+    return _get_or_load(
+        _embeddings_registry,
+        _embedding_key(configuration),
+        lambda: _load_embeddings(configuration),
+        "embedding"
+    )
+
+
+def get_cross_encoder(config=None):
+    """获取进程内共享的交叉编码器（用于相关性评分），未配置时返回None"""
+    configuration = Configuration.from_runnable_config(config)
+    if not configuration.relevance_cross_encoder:
+        return None
+
+    def load():
+        import torch
+        from sentence_transformers import CrossEncoder
+
+        # 输出统一为0~1的概率，与高低阈值比较
+        return CrossEncoder(
+            configuration.relevance_cross_encoder,
+            device=configuration.embedding_device,
+            activation_fn=torch.nn.Sigmoid()
+        )
+
+    return _get_or_load(
+        _cross_encoder_registry,
+        (configuration.relevance_cross_encoder, configuration.embedding_device),
+        load,
+        "cross_encoder"
+    )
+
+
+def get_registry_stats():
+    """返回模型/向量库的加载耗时与命中统计"""
+    with _stats_lock:
+        return dict(_registry_stats)
+
+
+def get_embedding_cache_stats(config=None):
+    """返回嵌入缓存的命中统计，未启用缓存时返回None"""
+    embeddings = get_embeddings(config)
+    return embeddings.stats() if isinstance(embeddings, CachedEmbeddings) else None
+
+
+def warm_up(config=None):
+    """在启动时预加载嵌入模型和向量库，并回收已过期的作用域"""
+    get_embeddings(config)
+    get_or_create_vector_db(config)
+    collect_expired_scopes(config)
+    return get_registry_stats()
+
+
+def _open_vector_db(embeddings, configuration):
+    model_id = embedding_model_id(configuration)
+    vectorstore = Chroma(
+        persist_directory=VECTOR_DB_PATH,
+        embedding_function=embeddings,
+        collection_metadata={"embedding_model": model_id, "hnsw:space": "cosine", "scoped": True},
+    )
+
+    # 拒绝使用与建库模型不一致的嵌入，避免写入无法匹配的向量
+    metadata = vectorstore._collection.metadata or {}
+    stored_model_id = metadata.get("embedding_model")
+    if stored_model_id is None:
+        print(f"向量库未记录嵌入模型，标记为: {model_id}")
+        _update_collection_metadata(vectorstore._collection, embedding_model=model_id)
+    elif stored_model_id != model_id:
+        raise EmbeddingModelMismatchError(
+            f"向量库 '{VECTOR_DB_PATH}' 使用 {stored_model_id} 构建，当前配置为 {model_id}。"
+            f"请恢复原嵌入配置，或删除 '{VECTOR_DB_PATH}' 后重新建库。"
+        )
+
+    # 旧版向量库的块没有作用域，全部归入共享语料，否则按作用域过滤时检索不到
+    metadata = vectorstore._collection.metadata or {}
+    if not metadata.get("scoped"):
+        _mark_shared_scope(vectorstore._collection)
+        _update_collection_metadata(vectorstore._collection, scoped=True)
+
+    return vectorstore
+
+
+def _update_collection_metadata(collection, **values):
+    # Chroma不允许在modify中重新设置hnsw参数
+    metadata = {k: v for k, v in (collection.metadata or {}).items() if not k.startswith("hnsw:")}
+    collection.modify(metadata={**metadata, **values})
+
+
+def _mark_shared_scope(collection):
+    for offset in range(0, collection.count(), UPSERT_BATCH_SIZE):
+        batch = collection.get(limit=UPSERT_BATCH_SIZE, offset=offset, include=["metadatas"])
+        missing = [(i, m or {}) for i, m in zip(batch["ids"], batch["metadatas"]) if not (m or {}).get("scope")]
+        if missing:
+            collection.update(
+                ids=[i for i, _ in missing],
+                metadatas=[{**m, "scope": SHARED_SCOPE} for _, m in missing]
+            )
+
+
+def split_documents(documents, config=None, cache_vectors=True):
+    """切分文档并返回 (块, 向量) 列表，句向量在切分和入库之间复用"""
+    configuration = Configuration.from_runnable_config(config)
+    return chunk_documents(
+        documents,
+        get_embeddings(config),
+        chunk_size=configuration.chunk_size,
+        chunk_overlap=configuration.chunk_overlap,
+        breakpoint_percentile=configuration.chunk_breakpoint_percentile,
+        min_chunk_size=configuration.chunk_min_size,
+        cache_vectors=cache_vectors,
+        pool_embeddings=configuration.chunk_pool_embeddings
+    )
+
+
+def _clean_metadata(metadata):
+    """Chroma只接受标量元数据"""
+    return {k: v for k, v in metadata.items() if isinstance(v, (str, int, float, bool))} or None
+
+
+def upsert_chunks(vectorstore, ids, chunks):
+    """使用已计算好的向量写入向量库，不再重新编码；倒排索引同步更新"""
+    lexical_index = get_lexical_index(vectorstore)
+    for start in range(0, len(chunks), UPSERT_BATCH_SIZE):
+        batch = chunks[start:start + UPSERT_BATCH_SIZE]
+        batch_ids = ids[start:start + UPSERT_BATCH_SIZE]
+        metadatas = [_clean_metadata(chunk.metadata) for chunk, _ in batch]
+        vectorstore._collection.upsert(
+            ids=batch_ids,
+            embeddings=np.stack([vector for _, vector in batch]),
+            documents=[chunk.page_content for chunk, _ in batch],
+            metadatas=metadatas,
+        )
+        lexical_index.add(batch_ids, [chunk.page_content for chunk, _ in batch], metadatas)
+
+
+def delete_chunks(vectorstore, ids):
+    ids = list(ids)
+    lexical_index = get_lexical_index(vectorstore)
+    for start in range(0, len(ids), UPSERT_BATCH_SIZE):
+        vectorstore.delete(ids=ids[start:start + UPSERT_BATCH_SIZE])
+        lexical_index.remove(ids[start:start + UPSERT_BATCH_SIZE])
+
+
+def _open_lexical_index(vectorstore):
+    index = LexicalIndex(VECTOR_DB_PATH)
+
+    # 倒排索引建立之前入库的块从向量库回填
+    collection = vectorstore._collection
+    if index.count() == 0 and collection.count():
+        print("正在从向量库回填倒排索引...")
+        for offset in range(0, collection.count(), UPSERT_BATCH_SIZE):
+            batch = collection.get(limit=UPSERT_BATCH_SIZE, offset=offset, include=["documents", "metadatas"])
+            index.add(batch["ids"], batch["documents"], batch["metadatas"])
+    return index
+
+
+def get_lexical_index(vectorstore):
+    """获取与向量库同步的BM25倒排索引"""
+    return _get_or_load(
+        _lexical_registry,
+        VECTOR_DB_PATH,
+        lambda: _open_lexical_index(vectorstore),
+        "lexical_index"
+    )
+
+
+def get_manifest():
+    """获取向量库对应的入库清单"""
+    return _get_or_load(
+        _manifest_registry,
+        VECTOR_DB_PATH,
+        lambda: IngestionManifest(VECTOR_DB_PATH),
+        "manifest"
+    )
+
+
+def get_vector_db(config=None):
+    """获取进程内共享的向量库句柄（每个进程只打开一次）"""
+    configuration = Configuration.from_runnable_config(config)
+    embeddings = get_embeddings(config)
+    return _get_or_load(
+        _vector_db_registry,
+        (VECTOR_DB_PATH, _embedding_key(configuration)),
+        lambda: _open_vector_db(embeddings, configuration),
+        "vector_db"
+    )
+
+
+def session_scope(session_id):
+    return f"session:{session_id}"
+
+
+def _stamp_scope(documents, scope, upload_id):
+    """在文档元数据中记录作用域和上传批次，检索时按元数据过滤"""
+    for doc in documents:
+        doc.metadata["scope"] = scope
+        if upload_id:
+            doc.metadata["upload_id"] = upload_id
+    return documents
+
+
+def _source_key(source, scope, upload_id, file_hash):
+    """上传的文件按内容版本记录在清单中，files目录中的文件按路径记录"""
+    return scoped_source(source, scope, file_hash if upload_id else None)
+
+
+def _retag_upload(keys, upload_id, config):
+    """
+        内容已在库中的重复上传：把已有块的upload_id改为本次批次，不重新编码和写入向量。
+
+    Returns:
+        int: 更新的块数
+    """
+    with _ingest_lock:
+        manifest = get_manifest()
+        ids = [i for key in keys for i in manifest.chunk_ids(key)]
+        vectorstore = get_vector_db(config)
+        lexical_index = get_lexical_index(vectorstore)
+        for start in range(0, len(ids), UPSERT_BATCH_SIZE):
+            batch_ids = ids[start:start + UPSERT_BATCH_SIZE]
+            vectorstore._collection.update(ids=batch_ids, metadatas=[{"upload_id": upload_id}] * len(batch_ids))
+            lexical_index.set_upload_id(batch_ids, upload_id)
+        if ids:
+            manifest.bump_corpus_version()
+    return len(ids)
+
+
+def touch_scope(scope, config=None):
+    """顺延非共享作用域的过期时间，共享语料不会过期"""
+    if scope == SHARED_SCOPE:
+        return
+    configuration = Configuration.from_runnable_config(config)
+    get_manifest().touch_scope(scope, configuration.scope_ttl_seconds)
+
+
+def collect_expired_scopes(config=None):
+    """
+        回收已过期的作用域：删除其全部来源的向量、倒排索引和清单记录。
+
+    Returns:
+        int: 删除的块数
+    """
+    manifest = get_manifest()
+    deleted = 0
+    for scope in manifest.expired_scopes():
+        print(f"--- 回收过期作用域 {scope} ---")
+        deleted += remove_sources(manifest.scope_sources(scope), config)
+        manifest.drop_scope(scope)
+    return deleted
+
+
+def _group_by_source(documents):
+    groups = {}
+    for doc in documents:
+        groups.setdefault(doc.metadata.get("source", "unknown"), []).append(doc)
+    return groups
+
+
+def ingest_documents(documents, config=None, file_info=None, scope=SHARED_SCOPE, upload_id=None):
+    """
+        按来源增量入库：内容未变的来源直接跳过，变更的来源只写入新块并删除旧块。
+
+    Args:
+        documents: 待入库的文档列表，按metadata中的source分组
+        config: 可选的RunnableConfig
+        file_info: 可选的 {source: (file_hash, size, mtime)}，没有时按文档内容计算哈希
+        scope (str)：文档所属的作用域，同一来源在不同作用域中分别入库
+        upload_id (str)：可选的上传批次ID，记录在块的元数据中；上传的来源按内容哈希入库，
+            内容已在库中时只把已有块改记为本批次，同名但内容不同的文件不会互相替换
+
+    Returns:
+        dict: added/deleted/skipped 的块或来源数量
+    """
+    file_info = file_info or {}
+    stats = {"added": 0, "deleted": 0, "skipped": 0}
+    manifest = get_manifest()
+
+    # 找出内容有变化的来源
+    # file_info中出现但没有文档的来源（如空文件）也要记录，清除其旧块
+    groups = _group_by_source(_stamp_scope(documents, scope, upload_id))
+    changed = {}
+    unchanged = []
+    for source in list(groups) + [s for s in file_info if s not in groups]:
+        docs = groups.get(source, [])
+        file_hash, size, mtime = file_info.get(source, (hash_documents(docs), 0, 0.0))
+        key = _source_key(source, scope, upload_id, file_hash)
+        record = manifest.get_file(key)
+        if record and record.file_hash == file_hash:
+            stats["skipped"] += 1
+            unchanged.append(key)
+            continue
+        changed[source] = (key, file_hash, size, mtime)
+
+    if upload_id and unchanged:
+        _retag_upload(unchanged, upload_id, config)
+    if not changed:
+        return stats
+
+    # 所有变化来源的文档合并为一个批次切分和编码，不占用入库锁
+    chunks_by_source = {source: {} for source in changed}
+    changed_docs = [doc for source in changed for doc in groups.get(source, [])]
+    for chunk, vector in split_documents(changed_docs, config):
+        source = chunk.metadata.get("source", "unknown")
+        key = changed[source][0]
+        chunks_by_source[source].setdefault(chunk_id(key, chunk.page_content), (chunk, vector))
+
+    with _ingest_lock:
+        vectorstore = get_vector_db(config)
+
+        # 块ID由块内容决定，已在库中的块不再写入
+        new_ids = []
+        new_chunks = []
+        for source, chunks in chunks_by_source.items():
+            known_ids = manifest.chunk_ids(changed[source][0])
+            for i, chunk in chunks.items():
+                if i not in known_ids:
+                    new_ids.append(i)
+                    new_chunks.append(chunk)
+
+        # 未池化时只对新块编码
+        upsert_chunks(vectorstore, new_ids, _encode_missing(new_chunks, config))
+        stats["added"] += len(new_ids)
+
+        for source, (key, file_hash, size, mtime) in changed.items():
+            stale_ids = manifest.replace_file(key, file_hash, chunks_by_source[source].keys(), size, mtime)
+            delete_chunks(vectorstore, stale_ids)
+            stats["deleted"] += len(stale_ids)
+
+        if stats["added"] or stats["deleted"]:
+            manifest.bump_corpus_version()
+
+    return stats
+
+
+def remove_sources(sources, config=None):
+    """删除来源及其全部向量，sources为清单中的来源键"""
+    deleted = 0
+    with _ingest_lock:
+        vectorstore = get_vector_db(config)
+        manifest = get_manifest()
+        for source in sources:
+            ids = manifest.remove_file(source)
+            delete_chunks(vectorstore, ids)
+            deleted += len(ids)
+        if deleted:
+            manifest.bump_corpus_version()
+    return deleted
+
+
+def _encode_missing(chunks, config):
+    """为没有向量的块编码（未启用句向量池化时）"""
+    missing = [i for i, (_, vector) in enumerate(chunks) if vector is None]
+    if missing:
+        vectors = get_embeddings(config).embed_documents([chunks[i][0].page_content for i in missing])
+        for i, vector in zip(missing, vectors):
+            chunks[i] = (chunks[i][0], np.asarray(vector, dtype=np.float32))
+    return chunks
+
+
+def _commit_stream_batch(name, file_hash, docs, position, config, scope=SHARED_SCOPE, upload_id=None):
+    """切分、编码并写入一批文档，然后在清单中提交断点；name为清单中的来源键"""
+    # 流式入库的文本大多只出现一次，句向量不保留在内存缓存中
+    chunks = {}
+    for chunk, vector in split_documents(_stamp_scope(docs, scope, upload_id), config, cache_vectors=False):
+        chunks.setdefault(chunk_id(name, chunk.page_content), (chunk, vector))
+
+    with _ingest_lock:
+        manifest = get_manifest()
+        existing = manifest.existing_chunk_ids(chunks.keys())
+        new_ids = [i for i in chunks if i not in existing]
+        upsert_chunks(get_vector_db(config), new_ids, _encode_missing([chunks[i] for i in new_ids], config))
+        # 先写向量库再提交断点：中断后重做的批次ID相同，重复写入不会产生重复块
+        manifest.commit_batch(name, file_hash, chunks.keys(), position)
+
+    return len(new_ids)
+
+
+def ingest_stream(source, file_hash, config=None, size=0, mtime=0.0, progress=None, scope=SHARED_SCOPE,
+                  upload_id=None):
+    """
+        流式分批入库大型CSV/文本文件：读取、切分、编码、写入都按批次进行，内存占用有上限。
+
+    每批的大小由ingest_memory_limit_mb决定：按文本字符数和切分单元数 × 向量维度 × 4字节估算一批的内存，
+    达到上限时写入该批。每批写入后在清单中记录已提交的行号，进程中断后再次入库同一文件版本时从断点继续。
+
+    Args:
+        source: 文件路径或 (文件名, 缓冲区) 元组
+        file_hash (str)：文件内容哈希，断点只对同一版本有效
+        config: 可选的RunnableConfig
+        size (int)、mtime (float)：文件状态，写入清单
+        progress: 可选的回调 progress(路径或文件名, stage, seconds)
+        scope (str)、upload_id (str)：文件所属的作用域和上传批次
+
+    Returns:
+        dict: added/deleted/skipped 的块或来源数量
+    """
+    configuration = Configuration.from_runnable_config(config)
+    progress = progress or (lambda path, stage, seconds: None)
+    display_name = source_name(source)
+    name = _source_key(display_name, scope, upload_id, file_hash)
+    manifest = get_manifest()
+    # 编码子批次的临时列表从预算中预留
+    dimension = embedding_dimension(config)
+    memory_limit = configuration.ingest_memory_limit_mb * 1024 * 1024
+    memory_limit -= min(memory_limit // 2, ENCODE_BATCH_SIZE * dimension * STREAM_BYTES_PER_LIST_FLOAT)
+    unit_bytes = 2 * 4 * dimension + STREAM_BYTES_PER_UNIT
+    stats = {"added": 0, "deleted": 0, "skipped": 0}
+
+    start = manifest.get_checkpoint(name, file_hash)
+    if start:
+        print(f"从第 {start} 行继续入库 {display_name}")
+
+    batch = []
+    batch_bytes = 0
+    position = start
+    started = time.perf_counter()
+    block_chars = configuration.chunk_size * 4
+    for doc, position in iter_stream_documents(source, start, block_chars=block_chars):
+        doc_bytes = len(doc.page_content) * STREAM_BYTES_PER_CHAR \
+            + count_units(doc, configuration.chunk_size) * unit_bytes
+        if batch and batch_bytes + doc_bytes > memory_limit:
+            stats["added"] += _commit_stream_batch(name, file_hash, batch, last_position, config, scope, upload_id)
+            progress(display_name, "batch", time.perf_counter() - started)
+            batch = []
+            batch_bytes = 0
+        if doc_bytes > memory_limit:
+            print(f"{display_name} 第 {position} 行附近的文本块估算需要 {doc_bytes // 1024 // 1024} MB，"
+                  f"超过内存上限 {configuration.ingest_memory_limit_mb} MB")
+        batch.append(doc)
+        batch_bytes += doc_bytes
+        last_position = position
+    if batch:
+        stats["added"] += _commit_stream_batch(name, file_hash, batch, position, config, scope, upload_id)
+
+    with _ingest_lock:
+        stale_ids = manifest.finish_file(name, file_hash, size, mtime)
+        delete_chunks(get_vector_db(config), stale_ids)
+        stats["deleted"] += len(stale_ids)
+        if stats["added"] or stats["deleted"]:
+            manifest.bump_corpus_version()
+
+    # 中断前提交的批次记录的是之前的上传批次
+    if upload_id and start:
+        _retag_upload([name], upload_id, config)
+
+    progress(display_name, "indexed", time.perf_counter() - started)
+    return stats
+
+
+def ingest_files(sources, config=None, file_info=None, progress=None, scope=SHARED_SCOPE, upload_id=None):
+    """
+        并行解析文件，并将解析结果流式送入批量的切块/编码/写入阶段。
+
+    Args:
+        sources: 文件路径或 (文件名, 缓冲区) 元组的列表
+        config: 可选的RunnableConfig
+        file_info: 可选的 {路径或文件名: (file_hash, size, mtime)}，哈希未变的文件不再解析
+        progress: 可选的回调 progress(路径或文件名, stage, seconds)，stage为 parsed/indexed/skipped/failed
+        scope (str)：文件所属的作用域，默认为共享语料
+        upload_id (str)：可选的上传批次ID；内容已在库中的文件不再入库，只把已有块改记为本批次
+
+    Returns:
+        dict: added/deleted/skipped 的块或来源数量
+    """
+    configuration = Configuration.from_runnable_config(config)
+    file_info = file_info or {}
+    progress = progress or (lambda path, stage, seconds: None)
+    stats = {"added": 0, "deleted": 0, "skipped": 0}
+    batch_docs, batch_info, batch_paths = [], {}, []
+
+    # 文件哈希与清单一致时无需解析
+    manifest = get_manifest()
+    pending = []
+    unchanged = []
+    for source in sources:
+        name = source_name(source)
+        key = _source_key(name, scope, upload_id, file_info[name][0]) if name in file_info else None
+        record = manifest.get_file(key) if key else None
+        if record and record.file_hash == file_info[name][0]:
+            stats["skipped"] += 1
+            unchanged.append(key)
+            progress(name, "skipped", 0.0)
+            continue
+
+        # 大型CSV/文本文件流式分批入库
+        size = source_size(source)
+        if file_extension(name) in STREAMABLE_EXTENSIONS \
+                and size > configuration.ingest_stream_threshold_mb * 1024 * 1024:
+            if name not in file_info:
+                file_hash = hash_bytes(source[1]) if isinstance(source, tuple) else hash_file(source)
+                file_info[name] = (file_hash, size, 0.0)
+                key = _source_key(name, scope, upload_id, file_hash)
+                record = manifest.get_file(key)
+                if record and record.file_hash == file_hash:
+                    stats["skipped"] += 1
+                    unchanged.append(key)
+                    progress(name, "skipped", 0.0)
+                    continue
+            file_hash, size, mtime = file_info[name]
+            result = ingest_stream(source, file_hash, config, size, mtime, progress, scope, upload_id)
+            for key in stats:
+                stats[key] += result[key]
+            continue
+
+        pending.append(source)
+
+    if upload_id and unchanged:
+        _retag_upload(unchanged, upload_id, config)
+
+    def flush():
+        if not batch_paths:
+            return
+        start = time.perf_counter()
+        result = ingest_documents(batch_docs, config, batch_info, scope, upload_id)
+        seconds = time.perf_counter() - start
+        for key in stats:
+            stats[key] += result[key]
+        for path in batch_paths:
+            progress(path, "indexed", seconds)
+        batch_docs.clear()
+        batch_info.clear()
+        batch_paths.clear()
+
+    batch_chars = 0
+    for path, docs, seconds, error in iter_loaded_files(pending, configuration.ingest_workers or None):
+        if error is not None:
+            print(f"加载错误 {path}: {error}")
+            progress(path, "failed", seconds)
+            continue
+        progress(path, "parsed", seconds)
+
+        batch_docs.extend(docs)
+        batch_paths.append(path)
+        if path in file_info:
+            batch_info[path] = file_info[path]
+        batch_chars += sum(len(doc.page_content) for doc in docs)
+        if batch_chars >= configuration.ingest_batch_chars:
+            flush()
+            batch_chars = 0
+
+    flush()
+    return stats
+
+
+def sync_directory(path=FILES_PATH, config=None, progress=None):
+    """
+        将目录与向量库同步：跳过未变化的文件，重新入库变化的文件，删除已移除文件的向量。
+
+    先比较文件大小和修改时间，只有变化时才计算内容哈希，内容哈希变化时才加载和编码。
+    """
+    print(f"--- 同步目录 {path} ---")
+    stats = {"added": 0, "deleted": 0, "skipped": 0}
+    manifest = get_manifest()
+    seen = set()
+    changed = {}
+
+    for root, _, filenames in os.walk(path):
+        for filename in sorted(filenames):
+            file_path = os.path.join(root, filename)
+            if not is_supported(file_path):
+                continue
+            seen.add(file_path)
+
+            stat = os.stat(file_path)
+            record = manifest.get_file(file_path)
+            if record and record.size == stat.st_size and record.mtime == stat.st_mtime:
+                stats["skipped"] += 1
+                continue
+
+            file_hash = hash_file(file_path)
+            if record and record.file_hash == file_hash:
+                manifest.touch(file_path, stat.st_size, stat.st_mtime)
+                stats["skipped"] += 1
+                continue
+
+            changed[file_path] = (file_hash, stat.st_size, stat.st_mtime)
+
+    result = ingest_files(list(changed), config, file_info=changed, progress=progress)
+    stats["added"] += result["added"]
+    stats["deleted"] += result["deleted"]
+
+    prefix = os.path.join(path, "")
+    removed = [source for source in manifest.sources() if source.startswith(prefix) and source not in seen]
+    stats["deleted"] += remove_sources(removed, config)
+
+    return stats
+
+
+def get_or_create_vector_db(config=None):
+    """获取或创建向量库，每个进程首次调用时将files目录增量同步到向量库"""
+    vectorstore = get_vector_db(config)
+
+    # 已同步时无锁返回，避免查询等待其他请求的入库操作
+    if FILES_PATH in _synced_paths:
+        return vectorstore
+
+    with _ingest_lock:
+        if FILES_PATH not in _synced_paths:
+            if os.path.isdir(FILES_PATH):
+                sync_directory(FILES_PATH, config)
+            _synced_paths.add(FILES_PATH)
 
     return vectorstore
 
-def add_documents(documents):
+def add_documents(documents, config=None):
     """
         将新文档添加到现有的向量库中。
 
+    重复添加相同内容的文档不会产生重复的块，同一来源内容变化时会替换旧块。
 
     Args:
         documents: 要添加到vector存储的文档列表
+        config: 可选的RunnableConfig，用于选择嵌入配置
     """
-    embeddings = HuggingFaceEmbeddings()
-
-    # 处理新文档
-    semantic_text_splitter = SemanticChunker(embeddings)
-    documents = semantic_text_splitter.split_documents(documents)
-
-    # 将结果文档拆分为更小的块
-    # 使用RecursiveCharacterTextSplitter来设置块大小
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=2000, chunk_overlap=400)
-    split_documents = text_splitter.split_documents(documents)
-
-    if os.path.exists(VECTOR_DB_PATH) and os.listdir(VECTOR_DB_PATH):
-        # 使用存在的 vector store
-        vectorstore = Chroma(persist_directory=VECTOR_DB_PATH, embedding_function=embeddings)
-        vectorstore.add_documents(split_documents)
-    else:
-        # 加载文档后建立新词向量库
-        vectorstore = Chroma.from_documents(
-            split_documents,
-            embeddings,
-            persist_directory=VECTOR_DB_PATH
-        )
+    ingest_documents(documents, config)
 
-    return vectorstore
\ No newline at end of file
+    return get_vector_db(config)
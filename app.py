@@ -1,14 +1,16 @@
+import uuid
 import pyperclip
 import streamlit as st
 import streamlit_nested_layout
 from Module import researcher
-from Module import get_report_structures, process_uploaded_files
+from Module import get_report_structures, process_uploaded_files, session_scope, touch_scope, warm_up
 from dotenv import load_dotenv
 
 load_dotenv()
 
 
-def generate_response(user_input, enable_web_search, report_structure, max_search_queries):
+def generate_response(user_input, enable_web_search, report_structure, max_search_queries, force_refresh=False,
+                      session_id=""):
     """
     使用agent和stream steps生成响应
     """
@@ -22,10 +24,18 @@ def generate_response(user_input, enable_web_search, report_structure, max_searc
         "enable_web_search": enable_web_search,
         "report_structure": report_structure,
         "max_search_queries": max_search_queries,
+        "force_refresh": force_refresh,
+        "session_id": session_id,
     }}
 
+    # 会话仍在使用，顺延其上传文档的过期时间
+    if session_id:
+        touch_scope(session_scope(session_id), config)
+
     # 为 global process 创建状态
     langgraph_status = st.status("**Researcher Running...**", state="running")
+    # 流式显示最终回答，生成完成后由聊天消息中的完整回答替换
+    answer_placeholder = st.empty()
 
     with langgraph_status:
         generate_queries_expander = st.expander("Generate Research Queries", expanded=False)
@@ -34,12 +44,15 @@ def generate_response(user_input, enable_web_search, report_structure, max_searc
 
         steps = []
 
-        # 运行 graph 和 stream outputs
-        for output in researcher.stream(initial_state, config=config):
+        def show_update(output):
             for key, value in output.items():
                 expander_label = key.replace("_", " ").title()
 
-                if key == "generate_research_queries":
+                if key == "lookup_cached_answer" and value.get("answer_cache_hit"):
+                    with final_answer_expander:
+                        st.write("已回答过相似的问题，直接返回缓存的报告")
+
+                elif key == "generate_research_queries":
                     with generate_queries_expander:
                         st.write(value)
 
@@ -54,6 +67,27 @@ def generate_response(user_input, enable_web_search, report_structure, max_searc
 
                 steps.append({"step": key, "content": value})
 
+        # 运行 graph 和 stream outputs，custom事件为最终回答的token
+        events = researcher.stream(initial_state, config=config, stream_mode=["updates", "custom"])
+
+        def answer_tokens(first_token):
+            yield first_token
+            for mode, chunk in events:
+                if mode == "custom":
+                    yield chunk.get("final_answer_token", "")
+                else:
+                    show_update(chunk)
+
+        for mode, chunk in events:
+            if mode == "custom":
+                # 第一个回答token到达后由write_stream接管剩余事件
+                with answer_placeholder.container():
+                    st.write_stream(answer_tokens(chunk.get("final_answer_token", "")))
+            else:
+                show_update(chunk)
+
+    answer_placeholder.empty()
+
     # 更新状态
     langgraph_status.update(state="complete", label="**Using Langgraph** (Research completed)")
 
@@ -70,6 +104,9 @@ def clear_chat():
 def main():
     st.set_page_config(page_title="DeepSeek RAG Researcher", layout="wide")
 
+    # 预加载嵌入模型和向量库，进程内只加载一次
+    warm_up()
+
     # Initialize session states
     if "processing_complete" not in st.session_state:
         st.session_state.processing_complete = False
@@ -81,6 +118,9 @@ def main():
         st.session_state.selected_report_structure = None
     if "max_search_queries" not in st.session_state:
         st.session_state.max_search_queries = 5
+    if "session_id" not in st.session_state:
+        # 本会话上传的文档只在本会话中检索，会话过期后被回收
+        st.session_state.session_id = uuid.uuid4().hex
     if "files_ready" not in st.session_state:
         st.session_state.files_ready = False  # 如果文件上传但未处理时Tracks
 
@@ -115,6 +155,7 @@ def main():
     )
 
     enable_web_search = st.sidebar.checkbox("启用联网搜索", value=True)
+    force_refresh = st.sidebar.checkbox("重新研究（不使用缓存的回答）", value=False)
 
     # 上传文档
     uploaded_files = st.sidebar.file_uploader(
@@ -124,6 +165,8 @@ def main():
         key=f"uploader_{st.session_state.uploader_key}"
     )
 
+    share_uploads = st.sidebar.checkbox("上传到共享知识库", value=False, help="不勾选时上传的文档只在本会话中可见")
+
     # 检查文件是否已上传但尚未处理
     if uploaded_files:
         st.session_state.files_ready = True
@@ -139,8 +182,15 @@ def main():
         if process_clicked:
             with process_button_placeholder:
                 with st.status("文档记忆中...", expanded=False) as status:
-                    # Process files (Replace this with your actual function)
-                    if process_uploaded_files(uploaded_files):
+                    stage_labels = {"parsed": "解析完成", "batch": "分批入库中", "indexed": "入库完成", "skipped": "内容未变",
+                                    "failed": "加载失败"}
+
+                    def report_progress(file_name, stage, seconds):
+                        st.write(f"{file_name}: {stage_labels.get(stage, stage)} ({seconds:.1f}s)")
+                        status.update(label=f"文档记忆中... {file_name} {stage_labels.get(stage, stage)}")
+
+                    session_id = None if share_uploads else st.session_state.session_id
+                    if process_uploaded_files(uploaded_files, progress=report_progress, session_id=session_id):
                         st.session_state.processing_complete = True
                         st.session_state.files_ready = False
                         st.session_state.uploader_key += 1
@@ -171,7 +221,9 @@ def main():
             user_input,
             enable_web_search,
             report_structure,
-            st.session_state.max_search_queries
+            st.session_state.max_search_queries,
+            force_refresh,
+            st.session_state.session_id
         )
 
         # 存储信息
@@ -0,0 +1,92 @@
+"""
+    嵌入后端的一致性检查和吞吐量基准。
+
+对比 sentence-transformers(torch) 与 ONNX fp32 / int8 后端：
+    - 一致性：同一文本在两个后端的向量余弦相似度，以及文本两两相似度矩阵的最大偏差
+    - 吞吐量：每秒编码的文本数
+
+用法:
+    python benchmark.py --texts 512 --batch-size 32
+"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+from langchain_huggingface import HuggingFaceEmbeddings
+from Module.chunking import split_sentences
+from Module.configuration import DEFAULT_EMBEDDING_MODEL
+from Module.loaders import is_supported, load_file
+from Module.onnx_embeddings import OnnxEmbeddings
+from Module.vector_db import FILES_PATH
+
+
+def sample_texts(count, max_length=500):
+    """优先使用files目录中的文档内容，没有文档时生成示例文本"""
+    texts = []
+    if os.path.isdir(FILES_PATH):
+        for name in sorted(os.listdir(FILES_PATH)):
+            path = os.path.join(FILES_PATH, name)
+            if not is_supported(path):
+                continue
+            for doc in load_file(path):
+                texts.extend(unit for unit in split_sentences(doc.page_content, max_length) if unit.strip())
+            if len(texts) >= count:
+                break
+
+    i = 0
+    while len(texts) < count:
+        texts.append(f"第{i}条示例文本：检索增强生成将向量检索与大模型结合。Example sentence number {i} about RAG.")
+        i += 1
+    return texts[:count]
+
+
+def measure(embeddings, texts, repeat):
+    embeddings.embed_documents(texts[:8])
+    start = time.perf_counter()
+    for _ in range(repeat):
+        vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+    return vectors, len(texts) * repeat / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="嵌入后端一致性检查与吞吐量基准")
+    parser.add_argument("--model", default=DEFAULT_EMBEDDING_MODEL, help="sentence-transformers模型目录")
+    parser.add_argument("--texts", type=int, default=512, help="参与测试的文本数")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--repeat", type=int, default=3, help="吞吐量测试的重复次数")
+    parser.add_argument("--min-cosine", type=float, default=0.99, help="一致性检查要求的最小余弦相似度")
+    args = parser.parse_args()
+
+    texts = sample_texts(args.texts)
+    backends = {
+        "torch": HuggingFaceEmbeddings(
+            model_name=args.model,
+            model_kwargs={"device": "cpu"},
+            encode_kwargs={"batch_size": args.batch_size, "normalize_embeddings": True},
+        ),
+        "onnx-fp32": OnnxEmbeddings(args.model, quantized=False, batch_size=args.batch_size),
+        "onnx-int8": OnnxEmbeddings(args.model, quantized=True, batch_size=args.batch_size),
+    }
+
+    results = {name: measure(embeddings, texts, args.repeat) for name, embeddings in backends.items()}
+    reference, reference_throughput = results["torch"]
+    reference_similarity = reference @ reference.T
+
+    print(f"{len(texts)} 条文本, batch_size={args.batch_size}, repeat={args.repeat}")
+    print(f"{'backend':<10} {'texts/s':>10} {'speedup':>8} {'min cos':>9} {'mean cos':>9} {'max Δsim':>9}")
+    passed = True
+    for name, (vectors, throughput) in results.items():
+        cosine = np.sum(vectors * reference, axis=1)
+        similarity_error = np.max(np.abs(vectors @ vectors.T - reference_similarity))
+        print(f"{name:<10} {throughput:>10.1f} {throughput / reference_throughput:>7.2f}x "
+              f"{cosine.min():>9.4f} {cosine.mean():>9.4f} {similarity_error:>9.4f}")
+        passed = passed and cosine.min() >= args.min_cosine
+
+    if not passed:
+        print(f"一致性检查未通过：最小余弦相似度低于 {args.min_cosine}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
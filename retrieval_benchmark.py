@@ -0,0 +1,95 @@
+"""
+    向量检索、BM25检索和混合检索在标注查询集上的召回率基准。
+
+在临时目录中用较小的chunk_size将files目录中的文档入库，对每种retrieval_mode计算：
+    - recall@k：前k个结果中包含期望片段的查询比例
+    - MRR：第一个包含期望片段的结果排名的倒数的平均值
+    - 平均块数和平均token数：送入下游提示词的检索结果大小
+
+前三行固定取k个块；hybrid+mmr 一行使用MMR去冗余和自适应块数（retrieval_adaptive_k）的默认配置。
+
+每条标注为 (查询, 期望出现在相关块中的原文片段)。
+
+用法:
+    python retrieval_benchmark.py --k 3 --chunk-size 200
+"""
+import argparse
+import os
+import shutil
+import tempfile
+from Module.context import estimate_tokens
+from Module.retrieval import retrieve_documents
+from Module.vector_db import FILES_PATH, get_or_create_vector_db
+
+LABELLED_QUERIES = [
+    ("DeepSeek-R1是什么时候发布的", "2025年1月20日"),
+    ("DeepSeek-R1-Lite 第一个推理模型", "第一个推理模型"),
+    ("DeepSeek-V3的训练成本是多少", "557.6万美元"),
+    ("DeepSeek-R1 API服务定价", "每百万输入tokens"),
+    ("DeepSeek登顶苹果App Store下载排行榜", "App Store"),
+    ("Meta 扎克伯格 人工智能投入", "扎克伯格"),
+    ("Meta成立研究小组研究DeepSeek模型", "四个研究小组"),
+    ("OpenAI 服务条款", "服务条款"),
+    ("DeepSeek R1 Lite 与 OpenAI o1 的价格差异", "价格相差极大"),
+    ("美国邀请数学考试 MATH 基准上的表现", "MATH"),
+]
+
+MODES = {
+    "vector": {"retrieval_mode": "vector", "mmr_enabled": False, "retrieval_adaptive_k": False},
+    "lexical": {"retrieval_mode": "lexical", "mmr_enabled": False, "retrieval_adaptive_k": False},
+    "hybrid": {"retrieval_mode": "hybrid", "mmr_enabled": False, "retrieval_adaptive_k": False},
+    "hybrid+mmr": {"retrieval_mode": "hybrid"},
+}
+
+
+def evaluate(settings, k):
+    config = {"configurable": {"retrieval_k": k, **settings}}
+    retrieved = retrieve_documents([query for query, _ in LABELLED_QUERIES], config)
+
+    hits = 0
+    reciprocal_ranks = 0.0
+    chunks = 0
+    tokens = 0
+    for query, expected in LABELLED_QUERIES:
+        chunks += len(retrieved[query])
+        tokens += sum(estimate_tokens(doc.page_content) for doc in retrieved[query])
+        for rank, doc in enumerate(retrieved[query], start=1):
+            if expected in doc.page_content:
+                hits += 1
+                reciprocal_ranks += 1 / rank
+                break
+    n = len(LABELLED_QUERIES)
+    return hits / n, reciprocal_ranks / n, chunks / n, tokens / n
+
+
+def main():
+    parser = argparse.ArgumentParser(description="向量/BM25/混合检索召回率基准")
+    parser.add_argument("--k", type=int, default=3, help="固定块数时每个查询检索的块数")
+    parser.add_argument("--chunk-size", type=int, default=200, help="入库时的块大小")
+    parser.add_argument("--chunk-overlap", type=int, default=50)
+    args = parser.parse_args()
+
+    # 在临时目录中建库，不影响项目的database目录
+    source = os.path.abspath(FILES_PATH)
+    workdir = tempfile.mkdtemp(prefix="retrieval_benchmark_")
+    cwd = os.getcwd()
+    try:
+        shutil.copytree(source, os.path.join(workdir, FILES_PATH))
+        os.chdir(workdir)
+        get_or_create_vector_db({"configurable": {
+            "chunk_size": args.chunk_size,
+            "chunk_overlap": args.chunk_overlap,
+        }})
+
+        print(f"{len(LABELLED_QUERIES)} 条标注查询, k={args.k}, chunk_size={args.chunk_size}")
+        print(f"{'mode':<11} {'recall@k':>9} {'MRR':>7} {'chunks':>7} {'tokens':>7}")
+        for name, settings in MODES.items():
+            recall, mrr, chunks, tokens = evaluate(settings, args.k)
+            print(f"{name:<11} {recall:>9.2f} {mrr:>7.3f} {chunks:>7.1f} {tokens:>7.0f}")
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+import zlib
+import numpy as np
+import pytest
+from chromadb.api.client import SharedSystemClient
+from langchain_core.embeddings import Embeddings
+import Module.vector_db as vector_db
+
+DIMENSION = 384
+
+
+class HashEmbeddings(Embeddings):
+    """按文本哈希生成确定的向量；与HuggingFaceEmbeddings一样返回list[list[float]]"""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def embed_documents(self, texts):
+        return [
+            np.random.default_rng(zlib.crc32(text.encode("utf-8"))).standard_normal(DIMENSION).tolist()
+            for text in texts
+        ]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """在临时目录中建库，并替换进程级的模型和向量库句柄"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(vector_db, "HuggingFaceEmbeddings", HashEmbeddings)
+    for registry in ("_embeddings_registry", "_vector_db_registry", "_manifest_registry", "_lexical_registry"):
+        monkeypatch.setattr(vector_db, registry, {})
+    monkeypatch.setattr(vector_db, "_synced_paths", set())
+    # Chroma按路径字符串缓存客户端，相对路径"database"在不同临时目录中不能复用
+    SharedSystemClient.clear_system_cache()
+    yield tmp_path
+    SharedSystemClient.clear_system_cache()
@@ -0,0 +1,45 @@
+import sqlite3
+from contextlib import closing
+from Module.lexical import LEXICAL_INDEX_FILE, LexicalIndex
+
+
+def build_index(directory):
+    index = LexicalIndex(str(directory))
+    index.add(
+        ["a", "b", "c"],
+        ["DeepSeek-R1 发布", "DeepSeek-R1 定价", "DeepSeek-V3 训练成本"],
+        [
+            {"scope": "shared", "source": "files/a.txt"},
+            {"scope": "session:s1", "upload_id": "u1", "source": "b.txt"},
+            {"scope": "session:s2", "upload_id": "u2", "source": "c.txt"},
+        ],
+    )
+    return index
+
+
+def test_search_filters_before_scoring(tmp_path):
+    index = build_index(tmp_path)
+
+    assert {i for i, _ in index.search("deepseek", None)} == {"a", "b", "c"}
+    assert {i for i, _ in index.search("deepseek", None, scopes=["shared", "session:s1"])} == {"a", "b"}
+    assert [i for i, _ in index.search("deepseek", None, scopes=["shared", "session:s1"], upload_id="u1")] == ["b"]
+    assert [i for i, _ in index.search("deepseek", None, scopes=["session:s2"], source="c.txt")] == ["c"]
+    assert index.search("deepseek", None, scopes=[]) == []
+    assert len(index.search("deepseek", 1, scopes=["shared", "session:s1"])) == 1
+
+
+def test_set_upload_id(tmp_path):
+    index = build_index(tmp_path)
+
+    index.set_upload_id(["b"], "u3")
+
+    assert not index.search("deepseek", None, upload_id="u1")
+    assert [i for i, _ in index.search("deepseek", None, upload_id="u3")] == ["b"]
+
+
+def test_index_without_metadata_columns_is_cleared_for_backfill(tmp_path):
+    with closing(sqlite3.connect(tmp_path / LEXICAL_INDEX_FILE)) as conn, conn:
+        conn.execute("CREATE TABLE chunks (chunk_id TEXT PRIMARY KEY, length INTEGER NOT NULL)")
+        conn.execute("INSERT INTO chunks VALUES ('a', 1)")
+
+    assert LexicalIndex(str(tmp_path)).count() == 0
@@ -0,0 +1,183 @@
+import asyncio
+import threading
+import pytest
+import Module.cache as cache
+from Module.cache import SearchCache
+from Module.utils import StaticSearchBackend, atavily_search, set_search_backend, tavily_search
+
+
+class GatedBackend(StaticSearchBackend):
+    """异步请求在gate打开之前一直挂起，用于构造在途请求"""
+
+    def __init__(self, responder):
+        super().__init__(responder)
+        self.started = asyncio.Event()
+        self.gate = asyncio.Event()
+
+    async def asearch(self, query, max_results, include_raw_content):
+        self.started.set()
+        await self.gate.wait()
+        return self.search(query, max_results, include_raw_content)
+
+
+def respond(query, max_results, include_raw_content):
+    return [{"title": query, "url": f"https://example.com/{query}", "content": "content"}]
+
+
+@pytest.fixture
+def search_cache(monkeypatch):
+    search_cache = SearchCache(ttl_seconds=60)
+    monkeypatch.setattr(cache, "_search_cache", search_cache)
+    return search_cache
+
+
+@pytest.fixture
+def backend():
+    backend = StaticSearchBackend(respond)
+    previous = set_search_backend(backend)
+    yield backend
+    set_search_backend(previous)
+
+
+def test_normalized_queries_share_cache_entry(search_cache, backend):
+    first = tavily_search("DeepSeek  R1")
+    second = tavily_search("ｄｅｅｐｓｅｅｋ r1")
+
+    assert first == second
+    assert backend.calls == 1
+    assert search_cache.stats()["hits"] == 1
+
+
+def test_cached_results_are_copies(search_cache, backend):
+    tavily_search("q")["results"].clear()
+
+    assert tavily_search("q")["results"]
+    assert backend.calls == 1
+
+
+def test_entries_expire_after_ttl(search_cache, backend, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "monotonic", lambda: now[0])
+
+    tavily_search("q")
+    now[0] += 30
+    tavily_search("q")
+    assert backend.calls == 1
+
+    now[0] += 31
+    tavily_search("q")
+    assert backend.calls == 2
+
+
+def test_concurrent_identical_queries_are_coalesced(search_cache):
+    gate = threading.Event()
+
+    def slow_respond(query, max_results, include_raw_content):
+        gate.wait(5)
+        return respond(query, max_results, include_raw_content)
+
+    backend = StaticSearchBackend(slow_respond)
+    previous = set_search_backend(backend)
+    try:
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(tavily_search("q"))) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        while search_cache.stats()["coalesced"] < 2:
+            threading.Event().wait(0.01)
+        gate.set()
+        for thread in threads:
+            thread.join(5)
+    finally:
+        set_search_backend(previous)
+
+    assert backend.calls == 1
+    assert len(results) == 3 and all(result == results[0] for result in results)
+
+
+def test_async_queries_are_coalesced(search_cache):
+    async def run():
+        backend = GatedBackend(respond)
+        previous = set_search_backend(backend)
+        try:
+            leader = asyncio.create_task(atavily_search("q"))
+            await backend.started.wait()
+            follower = asyncio.create_task(atavily_search("q"))
+            await asyncio.sleep(0)
+            backend.gate.set()
+            return backend, await leader, await follower
+        finally:
+            set_search_backend(previous)
+
+    backend, leader, follower = asyncio.run(run())
+    assert backend.calls == 1
+    assert leader == follower
+    assert search_cache.stats()["coalesced"] == 1
+
+
+def test_cancelled_leader_does_not_block_later_queries(search_cache):
+    async def run():
+        backend = GatedBackend(respond)
+        previous = set_search_backend(backend)
+        try:
+            leader = asyncio.create_task(atavily_search("q"))
+            await backend.started.wait()
+            follower = asyncio.create_task(atavily_search("q"))
+            await asyncio.sleep(0)
+
+            leader.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await leader
+
+            # 等待中的调用重新发起请求，之后的相同查询也不会挂起
+            backend.gate.set()
+            follower_result = await asyncio.wait_for(follower, 5)
+            later_result = await asyncio.wait_for(atavily_search("q"), 5)
+            return backend, follower_result, later_result
+        finally:
+            set_search_backend(previous)
+
+    backend, follower_result, later_result = asyncio.run(run())
+    assert follower_result == later_result
+    assert backend.calls == 1
+    assert not search_cache._in_flight
+
+
+def test_cancelled_follower_does_not_cancel_leader(search_cache):
+    async def run():
+        backend = GatedBackend(respond)
+        previous = set_search_backend(backend)
+        try:
+            leader = asyncio.create_task(atavily_search("q"))
+            await backend.started.wait()
+            follower = asyncio.create_task(atavily_search("q"))
+            await asyncio.sleep(0)
+
+            follower.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await follower
+            backend.gate.set()
+            return await asyncio.wait_for(leader, 5)
+        finally:
+            set_search_backend(previous)
+
+    assert asyncio.run(run())["results"]
+    assert not search_cache._in_flight
+
+
+def test_backend_errors_are_shared_and_not_cached(search_cache):
+    def failing(query, max_results, include_raw_content):
+        raise RuntimeError("backend down")
+
+    backend = StaticSearchBackend(failing)
+    previous = set_search_backend(backend)
+    try:
+        with pytest.raises(RuntimeError):
+            tavily_search("q")
+        with pytest.raises(RuntimeError):
+            tavily_search("q")
+    finally:
+        set_search_backend(previous)
+
+    assert backend.calls == 2
+    assert not search_cache._in_flight
@@ -0,0 +1,47 @@
+import csv
+import tracemalloc
+import Module.vector_db as vector_db
+
+
+def write_csv(path, rows):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["id", "name", "city", "score", "comment"])
+        for i in range(rows):
+            writer.writerow([i, ["张三", "李四", "王五"][i % 3], ["北京", "上海", "广州"][i % 3], i % 100, f"评论{i}很好"])
+
+
+def test_stream_ingest_stays_within_memory_limit(workdir):
+    rows = 6000
+    limit_mb = 4
+    path = str(workdir / "rows.csv")
+    write_csv(path, rows)
+    config = {"configurable": {"ingest_memory_limit_mb": limit_mb, "ingest_stream_threshold_mb": 0}}
+
+    # 预先加载模型和向量库，只测量入库本身
+    vectorstore = vector_db.get_vector_db(config)
+    vector_db.get_lexical_index(vectorstore)
+
+    stages = []
+    tracemalloc.start()
+    try:
+        stats = vector_db.ingest_files([path], config, progress=lambda name, stage, seconds: stages.append(stage))
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert stats["added"] == rows
+    assert stages.count("batch") >= 1
+    assert peak < limit_mb * 1024 * 1024
+
+
+def test_stream_ingest_keeps_csv_rows_whole(workdir):
+    path = str(workdir / "rows.csv")
+    write_csv(path, 200)
+    config = {"configurable": {"ingest_stream_threshold_mb": 0}}
+
+    vector_db.ingest_files([path], config)
+
+    documents = vector_db.get_vector_db(config)._collection.get(include=["documents"])["documents"]
+    assert len(documents) == 200
+    assert all(doc.count("id:") == 1 and "comment:" in doc for doc in documents)
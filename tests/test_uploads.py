@@ -0,0 +1,55 @@
+import Module.vector_db as vector_db
+from Module.utils import process_uploaded_files
+
+
+class UploadedFile:
+    """与Streamlit的UploadedFile一样提供name和getbuffer()"""
+
+    def __init__(self, name, text):
+        self.name = name
+        self._data = text.encode("utf-8")
+
+    def getbuffer(self):
+        return memoryview(self._data)
+
+
+TEXT = "\n\n".join(f"第{i}段：DeepSeek-R1 于 2025 年 1 月 20 日发布，这是用于测试的上传文本。" for i in range(20))
+
+
+def collection():
+    return vector_db.get_vector_db()._collection
+
+
+def test_reupload_reuses_chunks_and_retags_upload_id(workdir):
+    first = process_uploaded_files([UploadedFile("a.txt", TEXT)])
+    count = collection().count()
+    version = vector_db.get_manifest().corpus_version()
+
+    second = process_uploaded_files([UploadedFile("a.txt", TEXT)])
+
+    assert count > 0
+    assert collection().count() == count
+    assert len(collection().get(where={"upload_id": second})["ids"]) == count
+    assert not collection().get(where={"upload_id": first})["ids"]
+    lexical_index = vector_db.get_lexical_index(vector_db.get_vector_db())
+    assert len(lexical_index.search("deepseek", None, upload_id=second)) == count
+    assert not lexical_index.search("deepseek", None, upload_id=first)
+    # 块记到了新的批次，按批次过滤的缓存答案需要失效
+    assert vector_db.get_manifest().corpus_version() > version
+
+
+def test_reupload_in_session_scope_does_not_duplicate(workdir):
+    process_uploaded_files([UploadedFile("a.txt", TEXT)], session_id="s1")
+    count = collection().count()
+
+    process_uploaded_files([UploadedFile("a.txt", TEXT)], session_id="s1")
+
+    assert collection().count() == count
+
+
+def test_same_name_different_content_is_kept_apart(workdir):
+    first = process_uploaded_files([UploadedFile("a.txt", TEXT)])
+    second = process_uploaded_files([UploadedFile("a.txt", TEXT.replace("DeepSeek-R1", "DeepSeek-V3"))])
+
+    assert collection().get(where={"upload_id": first})["ids"]
+    assert collection().get(where={"upload_id": second})["ids"]